@@ -0,0 +1,161 @@
+# This module is to aggregate values of slots of 15 min by period: month, ISO week, day, hour or slot
+# Slots are grouped using their timestamp (datetime64), then values of each group are summed.
+#
+# Sums of each group are accumulated sequentially, in the order of slots, as sums done in python
+# loops: results are identical to the slot by slot implementation.
+import numpy as np
+
+# Resolutions of aggregation
+MONTH = 'mois'
+WEEK = 'semaine'
+DAY = 'jour'
+HOUR = 'heure'
+SLOT = 'creneau'
+
+RESOLUTION_LIST = [MONTH, WEEK, DAY, HOUR, SLOT]
+
+
+# This function returns the start of the period of each timestamp
+# Weeks are ISO weeks, starting on monday
+def get_period(timestamps, resolution):
+    timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+    if resolution == MONTH:
+        return timestamps.astype('datetime64[M]').astype('datetime64[m]')
+    if resolution == WEEK:
+        day = timestamps.astype('datetime64[D]').astype(np.int64)
+        # 1970-01-01 is a thursday, which is day 3 of the week
+        return (day - (day + 3) % 7).astype('datetime64[D]').astype('datetime64[m]')
+    if resolution == DAY:
+        return timestamps.astype('datetime64[D]').astype('datetime64[m]')
+    if resolution == HOUR:
+        return timestamps.astype('datetime64[h]').astype('datetime64[m]')
+    if resolution == SLOT:
+        return timestamps
+    raise ValueError('Unknown resolution: ' + str(resolution))
+
+
+# This function sums values (slots x ...) of each group, in the order of slots
+# group gives the index of the group of each slot, from 0 to nb_group - 1
+def sum_by_group(values, group, nb_group):
+    values = np.asarray(values, dtype=np.float64)
+    if len(group) == 0:
+        return np.zeros((nb_group,) + values.shape[1:])
+
+    # Put values of each group on one row, completed with zeros which do not change sums:
+    #   (groups x slots of the largest group x ...)
+    order = np.argsort(group, kind='stable')
+    sorted_group = group[order]
+    count = np.bincount(group, minlength=nb_group)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    position = np.arange(len(group)) - start[sorted_group]
+
+    padded = np.zeros((nb_group, count.max()) + values.shape[1:])
+    padded[sorted_group, position] = values[order]
+
+    # Sum columns one after the other, in place, so that sums are the ones of a sequential loop
+    total = padded[:, 0].copy()
+    for index in range(1, padded.shape[1]):
+        total += padded[:, index]
+    return total
+
+
+# This function groups slots by period and sums each array of value_list (slots x ...)
+# It returns start of each period, index of the last slot of each period, and sums (periods x ...)
+def aggregate(period, value_list):
+    period_list, group = np.unique(period, return_inverse=True)
+    group = group.reshape(-1)
+    last_index = np.zeros(len(period_list), dtype=np.int64)
+    np.maximum.at(last_index, group, np.arange(len(group)))
+    return period_list, last_index, [sum_by_group(values, group, len(period_list)) for values in value_list]
+
+
+# The following class contains results of a repartition aggregated by period
+class Aggregate:
+
+    def __init__(self, period_list, production, consumption, auto_consumption):
+        # Start of each period (datetime64)
+        self.period_list = period_list
+        # Production of each producer (periods x producers)
+        self.production = production
+        # Consumption of each consumer (periods x consumers)
+        self.consumption = consumption
+        # Auto_consumption of each consumer from each producer (periods x consumers x producers)
+        self.auto_consumption = auto_consumption
+
+    # This function returns auto_production rate of each consumer (periods x consumers)
+    # (sum of auto_consumption) / (consumption), in percent, 0 without consumption
+    def get_auto_production_rate(self):
+        auto_consumption = self.auto_consumption.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.consumption != 0, auto_consumption * 100 / self.consumption, 0.0)
+
+    # This function returns auto_consumption rate of each producer (periods x producers)
+    # (sum of auto_consumption) / (production), in percent, 0 without production
+    def get_auto_consumption_rate(self):
+        auto_consumption = self.auto_consumption.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.production != 0, auto_consumption * 100 / self.production, 0.0)
+
+
+# Resolutions of the pyramid of aggregates used to display charts
+PYRAMID_RESOLUTION_LIST = [SLOT, HOUR, DAY, MONTH]
+
+
+# The following class contains series aggregated at several resolutions
+# Each level is sorted by period, so that any range of periods is read without any computation
+class Pyramid:
+
+    def __init__(self, name_list, level_dict):
+        # Name of each series
+        self.name_list = name_list
+        # For each resolution: start of each period and values (periods x series)
+        self.level_dict = level_dict
+
+    # This function builds a pyramid from values of slots (slots x series)
+    @staticmethod
+    def build(timestamps, name_list, values, resolution_list=PYRAMID_RESOLUTION_LIST):
+        level_dict = {}
+        for resolution in resolution_list:
+            period_list, _, (level_values,) = aggregate(get_period(timestamps, resolution), [values])
+            level_dict[resolution] = (period_list, level_values)
+        return Pyramid(list(name_list), level_dict)
+
+    # This function returns periods and values of a resolution, between start and stop if given
+    def get(self, resolution, start=None, stop=None):
+        if resolution not in self.level_dict:
+            raise ValueError('Unknown resolution: ' + str(resolution))
+        period_list, values = self.level_dict[resolution]
+        first = 0 if start is None else np.searchsorted(period_list, np.datetime64(start, 'm'), side='left')
+        last = len(period_list) if stop is None else np.searchsorted(period_list, np.datetime64(stop, 'm'), side='right')
+        return period_list[first:last], values[first:last]
+
+    # This function saves the pyramid in a numpy file
+    def save(self, file):
+        array_dict = {'name_list': np.array(self.name_list, dtype=str)}
+        for resolution, (period_list, values) in self.level_dict.items():
+            array_dict[resolution + '_period'] = period_list
+            array_dict[resolution + '_values'] = values
+        with open(file, 'wb') as pyramid_file:
+            np.savez(pyramid_file, **array_dict)
+
+    # This function loads a pyramid saved in a numpy file
+    @staticmethod
+    def load(file):
+        with np.load(file) as data:
+            level_dict = {}
+            for name in data.files:
+                if name.endswith('_period'):
+                    resolution = name[:-len('_period')]
+                    level_dict[resolution] = (data[name], data[resolution + '_values'])
+            return Pyramid(data['name_list'].tolist(), level_dict)
+
+
+# This function builds the pyramid displayed in charts for a producer:
+# auto_consumption of each consumer, as written in statistics file, and production not used
+def build_auto_consumption_pyramid(rep, cons_list, index_prod=0):
+    initial_production = rep.initial_production[:, index_prod]
+    auto_cons = np.floor(initial_production[:, np.newaxis] * rep.get_key(index_prod=index_prod)) / 100
+    remaining_production = initial_production - auto_cons.sum(axis=1)
+    return Pyramid.build(rep.timestamps,
+                         [cons.name for cons in cons_list] + ['_Production restante'],
+                         np.column_stack([auto_cons, remaining_production]))
@@ -0,0 +1,185 @@
+# This module is to align load curves on a common timeline
+# Curves are joined by their timestamp instead of their position in the file:
+#   - timestamps are converted to UTC. Curves in French legal time (one hour missing at the end of
+#     March, one hour repeated at the end of October) are detected, other curves are in CET (UTC+1)
+#   - curves without year (Curve.DAY_MONTH) take the years of the first curve with a year: each month
+#     is placed in the year where this curve has most of its slots of this month, so that a curve from
+#     december to november is covered. Slots of 29.02 are dropped when this year is not a leap year
+#   - slots of the timeline missing in a curve (gaps, different start or end dates) have a value of 0,
+#     a curve missing more than MAX_MISSING_RATIO of the timeline is an error (see check_missing)
+# The timeline is the one of the first curve. It is processed by windows of slots, so that
+# temporary arrays stay small whatever the length of the history.
+import numpy as np
+
+import Curve
+import Metrics
+
+# Offset from UTC of winter time (CET) and summer time (CEST)
+WINTER_OFFSET = np.timedelta64(60, 'm')
+SUMMER_OFFSET = np.timedelta64(120, 'm')
+
+# Summer time starts on the last sunday of march and ends on the last sunday of october, at 01:00 UTC
+SUMMER_START_MONTH = 3
+SUMMER_END_MONTH = 10
+CHANGE_TIME = np.timedelta64(60, 'm')
+
+# Number of slots of the timeline aligned at once (31 days)
+WINDOW_SIZE = 31 * 96
+
+# Maximum part of the timeline without value in a curve, above it curves do not cover the same period
+MAX_MISSING_RATIO = 0.1
+
+
+# This function returns the last sunday of a month of each year (datetime64 in days)
+def get_last_sunday(year, month):
+    next_month = ((np.asarray(year) - 1970) * 12 + month).astype('datetime64[M]')
+    last_day = next_month.astype('datetime64[D]') - np.timedelta64(1, 'D')
+    # 1970-01-01 is a thursday, which is day 3 of the week, sunday is day 6
+    weekday = (last_day.astype(np.int64) + 3) % 7
+    return last_day - ((weekday + 1) % 7).astype('timedelta64[D]')
+
+
+# This function returns start and end of summer time (UTC) of each year
+def get_summer_time(year):
+    start = get_last_sunday(year, SUMMER_START_MONTH).astype('datetime64[m]') + CHANGE_TIME
+    end = get_last_sunday(year, SUMMER_END_MONTH).astype('datetime64[m]') + CHANGE_TIME
+    return start, end
+
+
+# This function returns true if local timestamps follow French legal time:
+# an hour is repeated in october, or the hour skipped in march is missing
+def is_legal_time(timestamps):
+    if len(timestamps) == 0:
+        return False
+    if len(np.unique(timestamps)) < len(timestamps):
+        return True
+    first, last = timestamps.min(), timestamps.max()
+    year = np.arange(first.astype('datetime64[Y]').astype(np.int64),
+                     last.astype('datetime64[Y]').astype(np.int64) + 1) + 1970
+    # Local time of the first slot skipped in march (02:00)
+    skipped, _ = get_summer_time(year)
+    skipped = skipped + WINTER_OFFSET
+    skipped = skipped[(skipped > first) & (skipped < last)]
+    return len(skipped) > 0 and not np.isin(skipped, timestamps).all()
+
+
+# This function converts local timestamps to UTC
+# In legal time, slots of the hour repeated in october are in summer time the first time they
+# appear in the curve, and in winter time the next times
+def to_utc(timestamps):
+    timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+    if not is_legal_time(timestamps):
+        return timestamps - WINTER_OFFSET
+
+    year, year_index = np.unique(timestamps.astype('datetime64[Y]'), return_inverse=True)
+    start, end = get_summer_time(year.astype(np.int64) + 1970)
+    start, end = start[year_index.reshape(-1)], end[year_index.reshape(-1)]
+
+    summer_utc = timestamps - SUMMER_OFFSET
+    winter_utc = timestamps - WINTER_OFFSET
+    summer = (summer_utc >= start) & (summer_utc < end)
+
+    # Slots which may be in summer time or in winter time
+    ambiguous = summer & (winter_utc >= end)
+    if ambiguous.any():
+        order = np.argsort(timestamps, kind='stable')
+        sorted_timestamps = timestamps[order]
+        repeated = np.zeros(len(timestamps), dtype=bool)
+        repeated[order[1:]] = sorted_timestamps[1:] == sorted_timestamps[:-1]
+        summer &= ~(ambiguous & repeated)
+
+    return np.where(summer, summer_utc, winter_utc)
+
+
+# This function returns the year of each month (array of 12 years, january first) taken by curves
+# without year: the year where the first curve with a year has most of its slots of this month.
+# Months missing in this curve take the year where it has most of its slots.
+# It returns None if no curve has a year
+def get_year_by_month(curve_list):
+    for curve in curve_list:
+        if curve.date_format == Curve.DAY_MONTH_YEAR and len(curve) > 0:
+            month_index = np.asarray(curve.timestamps, dtype='datetime64[m]').astype('datetime64[M]').astype(np.int64)
+            year = month_index // 12
+            first_year = year.min()
+            # Number of slots of each month of each year (years x months)
+            count = np.bincount((year - first_year) * 12 + month_index % 12).astype(np.int64)
+            count = np.pad(count, (0, -len(count) % 12)).reshape(-1, 12)
+            year_by_month = count.argmax(axis=0)
+            year_by_month[count.max(axis=0) == 0] = count.sum(axis=1).argmax()
+            return year_by_month + first_year + 1970
+    return None
+
+
+# This function returns local timestamps of a curve, in the years given for each month for curves without year
+# Slots which do not exist in their year (29.02) are NaT
+def get_local_timestamps(curve, year_by_month=None):
+    timestamps = np.asarray(curve.timestamps, dtype='datetime64[m]')
+    if curve.date_format != Curve.DAY_MONTH or year_by_month is None:
+        return timestamps
+    month_start = timestamps.astype('datetime64[M]')
+    offset = timestamps - month_start.astype('datetime64[m]')
+    month = month_start.astype(np.int64) % 12
+    month_start = ((year_by_month[month] - 1970) * 12 + month).astype('datetime64[M]')
+    local = month_start.astype('datetime64[m]') + offset
+    return np.where(local < (month_start + 1).astype('datetime64[m]'), local, np.datetime64('NaT'))
+
+
+# This function returns local timestamps and values of a curve, without slots which do not exist
+# in their year
+def get_local_curve(curve, year_by_month=None):
+    timestamps = get_local_timestamps(curve, year_by_month)
+    values = np.asarray(curve.values)
+    valid = ~np.isnat(timestamps)
+    if not valid.all():
+        Metrics.log('dropped_slots', slots=np.count_nonzero(~valid), reason='not in the year of the timeline')
+        timestamps, values = timestamps[valid], values[valid]
+    return timestamps, values
+
+
+# This function aligns curves on the timeline of the first curve
+# It returns local timestamps of the timeline, values of each curve (slots x curves)
+# and the number of slots of the timeline without value in each curve
+def align(curve_list, window_size=WINDOW_SIZE):
+    year_by_month = get_year_by_month(curve_list)
+    local_list, curve_value_list = zip(*[get_local_curve(curve, year_by_month) for curve in curve_list])
+    utc_list = [to_utc(timestamps) for timestamps in local_list]
+    timeline = utc_list[0]
+
+    values = np.zeros((len(timeline), len(curve_list)))
+    missing = np.zeros(len(curve_list), dtype=np.int64)
+    for index_curve, (utc, curve_values) in enumerate(zip(utc_list, curve_value_list)):
+        # Curves with the same slots are copied directly
+        if np.array_equal(utc, timeline):
+            values[:, index_curve] = curve_values
+            continue
+        if len(utc) == 0:
+            missing[index_curve] = len(timeline)
+            continue
+
+        # First value of each timestamp is used
+        order = np.argsort(utc, kind='stable')
+        sorted_utc = utc[order]
+        for start in range(0, len(timeline), window_size):
+            window = timeline[start:start + window_size]
+            position = np.minimum(np.searchsorted(sorted_utc, window), len(sorted_utc) - 1)
+            found = sorted_utc[position] == window
+            values[start:start + len(window), index_curve] = np.where(found, curve_values[order[position]], 0.0)
+            missing[index_curve] += np.count_nonzero(~found)
+
+    return local_list[0], values, missing
+
+
+# This function checks the number of slots of the timeline without value in each curve
+# name_list gives the name of each curve, used in messages
+# It raises ValueError when a curve misses more than max_ratio of the timeline, as it does not cover
+# the same period as the first curve and results would be computed with values of 0
+def check_missing(name_list, missing, nb_slot, max_ratio=MAX_MISSING_RATIO):
+    error_list = []
+    for name, nb_missing in zip(name_list, missing.tolist()):
+        if nb_missing == 0:
+            continue
+        Metrics.log('missing_slots', curve=name, slots=nb_missing, timeline=nb_slot)
+        if nb_missing > max_ratio * nb_slot:
+            error_list.append(str(name) + ' (' + str(nb_missing) + ' of ' + str(nb_slot) + ' slots)')
+    if error_list:
+        raise ValueError('Curves do not cover the period of the first producer: ' + ', '.join(error_list))
@@ -0,0 +1,219 @@
+# This module is to measure time spent by each stage of a repartition on a synthetic community
+# Curves of 15 min are generated for the given number of consumers, producers and years:
+#   - production looks like solar production: null at night, higher in summer, with cloudy days
+#   - consumption has a base load with peaks in the morning and in the evening, higher in winter
+# For each strategy, stages are timed: load, build_rep, write keys, statistics, monthly report,
+# indicators and chart data. Results are written in a JSON file, to be compared between versions.
+#
+# Usage: python Benchmark.py --consumers 100 --producers 2 --years 1 --output benchmark.json
+#        [--compare previous_benchmark.json]
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import Aggregation
+import Chart
+import Consumer
+import Curve
+import CurveRepository
+import Export
+import Producer
+import Repartition
+
+# First year of synthetic curves
+FIRST_YEAR = 2023
+
+# Strategies measured
+STRATEGY_LIST = [Repartition.Strategy.DYNAMIC_BY_DEFAULT, Repartition.Strategy.DYNAMIC]
+
+# Number of priority levels of consumers
+NB_PRIORITY = 3
+
+
+# This function returns timestamps of all slots of 15 min of the given years
+def generate_timestamps(nb_year, first_year=FIRST_YEAR):
+    start = np.datetime64(str(first_year) + '-01-01T00:00', 'm')
+    stop = np.datetime64(str(first_year + nb_year) + '-01-01T00:00', 'm')
+    return np.arange(start, stop, np.timedelta64(15, 'm'))
+
+
+# This function returns the hour of the day (float) and the day of the year of each timestamp
+def get_time_of_day(timestamps):
+    day = timestamps.astype('datetime64[D]')
+    hour = (timestamps - day.astype('datetime64[m]')).astype(np.int64) / 60
+    day_of_year = (day - day.astype('datetime64[Y]').astype('datetime64[D]')).astype(np.int64)
+    return hour, day_of_year
+
+
+# This function generates a solar production curve (Wh per slot)
+def generate_production(timestamps, peak, rng):
+    hour, day_of_year = get_time_of_day(timestamps)
+    # Longer and higher days in summer
+    season = 0.5 - 0.5 * np.cos(2 * np.pi * (day_of_year + 10) / 365)
+    day_length = 8 + 8 * season
+    sun = np.clip(np.cos(np.pi * (hour - 13) / day_length), 0, None)
+    # Cloudiness of each day
+    nb_day = len(timestamps) // 96 + 1
+    cloud = rng.uniform(0.2, 1.0, nb_day)[np.arange(len(timestamps)) // 96]
+    return np.round(peak * sun * (0.4 + 0.6 * season) * cloud, 2)
+
+
+# This function generates a consumption curve (Wh per slot)
+def generate_consumption(timestamps, base, rng):
+    hour, day_of_year = get_time_of_day(timestamps)
+    winter = 0.5 + 0.5 * np.cos(2 * np.pi * (day_of_year + 10) / 365)
+    peak = np.exp(-((hour - 8) ** 2) / 2) + 1.5 * np.exp(-((hour - 19.5) ** 2) / 3)
+    noise = rng.lognormal(0, 0.3, len(timestamps))
+    return np.round(base * (1 + 0.5 * winter) * (0.5 + peak) * noise, 1)
+
+
+# This function returns the content of a load curve file
+def to_text(curve):
+    value_list = [str(value).replace('.', ',') for value in curve.values.tolist()]
+    return 'Horodate;\n' + '\n'.join(slot + ';' + value for slot, value in zip(curve.slot_list(), value_list)) + '\n'
+
+
+# This function generates load curves files of a community
+# It returns content of files of producers and of consumers, and priority and ratio of consumers
+def generate_community(nb_cons, nb_prod, nb_year, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = generate_timestamps(nb_year)
+
+    prod_text_list = []
+    for index_prod in range(nb_prod):
+        values = generate_production(timestamps, rng.uniform(1000, 5000) * nb_cons / nb_prod, rng)
+        prod_text_list.append(to_text(Curve.Curve(timestamps, values)))
+
+    cons_text_list = []
+    for index_cons in range(nb_cons):
+        values = generate_consumption(timestamps, rng.uniform(100, 1000), rng)
+        cons_text_list.append(to_text(Curve.Curve(timestamps, values)))
+
+    # Ratios of consumers of each priority share the production of each producer
+    priority = rng.integers(0, NB_PRIORITY, (nb_cons, nb_prod))
+    ratio = np.zeros((nb_cons, nb_prod))
+    for level in range(NB_PRIORITY):
+        match = priority == level
+        ratio = np.where(match, np.floor(100 / np.maximum(match.sum(axis=0), 1)), ratio)
+
+    return prod_text_list, cons_text_list, priority.tolist(), ratio.tolist()
+
+
+# The following class records time of each stage
+class Timer:
+
+    def __init__(self):
+        self.result_list = []
+
+    # This function calls function, records its time and returns its result
+    def run(self, stage, strategy, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.result_list.append({'stage': stage, 'strategy': strategy, 'seconds': time.perf_counter() - start})
+        print(stage + ' (strategy ' + str(strategy) + '): ' + format(self.result_list[-1]['seconds'], '.3f') + ' s')
+        return result
+
+
+# This function loads curves as the application does: conversion to binary format, then memory-mapping
+def load_community(folder, prod_text_list, cons_text_list, priority, ratio):
+    repository = CurveRepository.CurveRepository(os.path.join(folder, 'curves'))
+    prod_list = []
+    for index_prod, text in enumerate(prod_text_list):
+        producer = Producer.Producer('Producteur_' + str(index_prod + 1), 'P' + str(index_prod + 1))
+        producer.open_production(repository.add_data(text.encode('latin-1')))
+        prod_list.append(producer)
+    cons_list = []
+    for index_cons, text in enumerate(cons_text_list):
+        consumer = Consumer.Consumer('Consommateur_' + str(index_cons + 1), 'C' + str(index_cons + 1),
+                                     priority[index_cons], ratio[index_cons])
+        consumer.open_consumption(repository.add_data(text.encode('latin-1')))
+        cons_list.append(consumer)
+    return prod_list, cons_list
+
+
+# This function builds the data of the chart of auto-consumption by day, as sent by /data
+def build_chart(rep, cons_list):
+    pyramid = Aggregation.build_auto_consumption_pyramid(rep, cons_list)
+    period_list, values = pyramid.get(Aggregation.DAY)
+    return Chart.build_data(period_list, values, pyramid.name_list, format=Chart.COMPACT)
+
+
+# This function runs the benchmark and returns its results
+def run(nb_cons, nb_prod, nb_year, strategy_list=STRATEGY_LIST, workers=1, seed=0):
+    prod_text_list, cons_text_list, priority, ratio = generate_community(nb_cons, nb_prod, nb_year, seed)
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    timer = Timer()
+    try:
+        prod_list, cons_list = timer.run('load', None, load_community, folder,
+                                         prod_text_list, cons_text_list, priority, ratio)
+        export_folder = os.path.join(folder, '')
+        for strategy in strategy_list:
+            rep = Repartition.Repartition()
+            timer.run('build_rep', strategy, rep.build_rep, prod_list, cons_list, strategy, None, workers)
+            for stage, sink in (('write_keys', Export.KeySink(export_folder, debug_info=True)),
+                                ('statistics', Export.StatisticsSink(export_folder)),
+                                ('monthly_report', Export.MonthlyReportSink(export_folder)),
+                                ('indicators', Export.IndicatorSink())):
+                timer.run(stage, strategy, Export.export, rep, prod_list, cons_list, [sink])
+            timer.run('chart', strategy, build_chart, rep, cons_list)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'system': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'parameters': {
+            'consumers': nb_cons,
+            'producers': nb_prod,
+            'years': nb_year,
+            'slots': len(generate_timestamps(nb_year)),
+            'workers': workers,
+            'seed': seed
+        },
+        'results': timer.result_list
+    }
+
+
+# This function prints time of each stage compared to a previous benchmark
+def compare(previous, current):
+    previous_dict = {(result['stage'], result['strategy']): result['seconds'] for result in previous['results']}
+    if previous['parameters'] != current['parameters']:
+        print('Warning: parameters of benchmarks are different')
+    for result in current['results']:
+        before = previous_dict.get((result['stage'], result['strategy']))
+        if before:
+            print(result['stage'] + ' (strategy ' + str(result['strategy']) + '): '
+                  + format(before, '.3f') + ' s -> ' + format(result['seconds'], '.3f') + ' s ('
+                  + format(100 * (result['seconds'] - before) / before, '+.1f') + '%)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure time of each stage of a repartition on synthetic curves')
+    parser.add_argument('--consumers', type=int, default=10)
+    parser.add_argument('--producers', type=int, default=1)
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='JSON file of a previous benchmark')
+    args = parser.parse_args()
+
+    benchmark = run(args.consumers, args.producers, args.years, workers=args.workers, seed=args.seed)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(benchmark, file, indent=2)
+    print('Benchmark written in ' + args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file), benchmark)
@@ -0,0 +1,148 @@
+# This module is to build the data of charts sent to the browser
+# Two formats are available:
+#   - json: x and y of each trace are lists of values
+#   - compact: x is a start date with a fixed step (or offsets from the start), and y of each
+#     trace is an array of float32 encoded in base64, read in the browser as a typed array
+#
+# Long series can be downsampled to the width of the chart. Traces are stacked, so the same
+# periods are kept for all traces: they are selected on the top of the stack (sum of traces).
+import base64
+
+import numpy as np
+
+# Formats of chart data
+JSON = 'json'
+COMPACT = 'compact'
+
+FORMAT_LIST = [JSON, COMPACT]
+
+# Methods of downsampling
+# LTTB (largest triangle three buckets) keeps one point per bucket, the one keeping the shape of the curve
+# MIN_MAX keeps the minimum and the maximum of each bucket, so that peaks are never lost
+LTTB = 'lttb'
+MIN_MAX = 'minmax'
+
+DOWNSAMPLING_LIST = [LTTB, MIN_MAX]
+
+
+# This function encodes an array in base64, values are little-endian
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+# This function returns the step (minutes) between periods, or None if periods are not regular
+def get_step(period_list):
+    if len(period_list) < 2:
+        return None
+    step_list = np.diff(period_list.astype('datetime64[m]').astype(np.int64))
+    if step_list[0] > 0 and np.all(step_list == step_list[0]):
+        return int(step_list[0])
+    return None
+
+
+# This function returns indexes of count points selected with LTTB
+# First and last points are always kept, other points are split in count - 2 buckets
+def get_lttb_index(x, y, count):
+    nb_point = len(y)
+    if count >= nb_point or count < 3:
+        return np.arange(nb_point)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Limits of buckets, each bucket contains at least one point as count < nb_point
+    limit = np.floor(np.linspace(1, nb_point - 1, count - 1)).astype(np.int64)
+    limit[-1] = nb_point - 1
+
+    index = np.empty(count, dtype=np.int64)
+    index[0] = 0
+    index[-1] = nb_point - 1
+    selected = 0
+    for bucket in range(count - 2):
+        start, stop = limit[bucket], limit[bucket + 1]
+        # Third point of triangles is the average of next bucket, or the last point
+        next_stop = limit[bucket + 2] if bucket + 2 < count - 1 else nb_point
+        average_x = x[stop:next_stop].mean()
+        average_y = y[stop:next_stop].mean()
+
+        area = np.abs((x[selected] - average_x) * (y[start:stop] - y[selected])
+                      - (x[selected] - x[start:stop]) * (average_y - y[selected]))
+        selected = start + int(np.argmax(area))
+        index[bucket + 1] = selected
+    return index
+
+
+# This function returns indexes of the minimum and maximum of y in count // 2 buckets, in order
+def get_min_max_index(y, count):
+    nb_point = len(y)
+    nb_bucket = count // 2
+    if count >= nb_point or nb_bucket < 1:
+        return np.arange(nb_point)
+
+    limit = np.linspace(0, nb_point, nb_bucket + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(nb_bucket), np.diff(limit))
+    # Points sorted by bucket then by value: minimum and maximum are at limits of each bucket
+    order = np.lexsort((y, bucket))
+    return np.unique(np.concatenate((order[limit[:-1]], order[limit[1:] - 1])))
+
+
+# This function reduces series (periods x series) to about count periods
+def downsample(period_list, values, count, method=LTTB):
+    total = values.sum(axis=1)
+    if method == MIN_MAX:
+        index = get_min_max_index(total, count)
+    else:
+        index = get_lttb_index(period_list.astype('datetime64[m]').astype(np.int64), total, count)
+    return period_list[index], values[index]
+
+
+# This function returns periods as strings read by plotly
+def format_periods(period_list):
+    return np.char.replace(np.datetime_as_string(period_list, unit='m'), 'T', ' ').tolist()
+
+
+# This function returns stacked traces of series (periods x series)
+# Values of traces are added by the browser in compact format, see build_compact_data
+def build_traces(name_list):
+    trace_list = []
+    for name in name_list:
+        trace_list.append({
+            'type': 'scatter',
+            'mode': 'lines',
+            'fill': 'tonexty' if len(trace_list) > 0 else 'tozeroy',
+            'stackgroup': 'one',
+            'name': name
+        })
+    return trace_list
+
+
+# This function returns traces with x and y as lists
+def build_json_data(period_list, values, name_list):
+    x = format_periods(period_list)
+    trace_list = build_traces(name_list)
+    for index, trace in enumerate(trace_list):
+        trace['x'] = x
+        trace['y'] = values[:, index].tolist()
+    return {'format': JSON, 'data': trace_list}
+
+
+# This function returns traces without x and y, and x and y in compact format:
+#   - x: start (minutes since 1970-01-01) and step (minutes), or offsets from start (int32, minutes)
+#   - y: float32 values of each trace
+def build_compact_data(period_list, values, name_list):
+    minutes = period_list.astype('datetime64[m]').astype(np.int64)
+    start = int(minutes[0]) if len(minutes) > 0 else 0
+    step = get_step(period_list)
+    x = {'start': start, 'step': step, 'count': len(minutes)}
+    if step is None:
+        x['offsets'] = encode_array(minutes - start, '<i4')
+
+    trace_list = build_traces(name_list)
+    y_list = [encode_array(values[:, index], '<f4') for index in range(len(trace_list))]
+    return {'format': COMPACT, 'data': trace_list, 'x': x, 'y': y_list}
+
+
+# This function returns chart data in the given format
+def build_data(period_list, values, name_list, format=JSON):
+    if format == COMPACT:
+        return build_compact_data(period_list, values, name_list)
+    return build_json_data(period_list, values, name_list)
@@ -1,5 +1,6 @@
 # This module is to define Consumer class
-import csv
+import Curve
+import CurveRepository
 
 class Consumer:
 
@@ -20,23 +21,39 @@ class Consumer:
         self.priority_list = priority_list
         # List of ratio of the consumer for each producer
         self.ratio_list = ratio_list
-        # List of points for each slot of 15 min
-        self.point_list = []
+        # Consumption curve: timestamp and consumption for each slot of 15 min
+        self.curve = Curve.Curve.empty()
         if file is not None:
             self.read_consumption(file)
 
+    # Consumption for each slot of 15 min
+    @property
+    def consumption(self):
+        return self.curve.values
+
+    # List of points for each slot of 15 min
+    # Points are built from the curve when accessed, they are kept for compatibility
+    @property
+    def point_list(self):
+        return Curve.PointList(self.curve, Consumer.Point)
+
+    # Objects saved before curves were stored as arrays contain a list of points
+    def __setstate__(self, state):
+        if 'point_list' in state:
+            point_list = state.pop('point_list')
+            state['curve'] = Curve.Curve.from_points([point.slot for point in point_list],
+                                                     [point.cons for point in point_list])
+        self.__dict__.update(state)
+
     # This function reads a file to set consumption values
     def read_consumption(self, file):
-        with open(file, newline='') as csvfile:
-            next(csvfile) # Skip first line of the file which contains title
-            cons_file = csv.reader(csvfile,delimiter=';')
-            for row in cons_file:
-                try:
-                    self.point_list.append(Consumer.Point(row[0], float(row[1].replace(',','.'))))
-                except ValueError as e:
-                    print('Erreur')
-                #print(row)
-            print('Consumer file read!')
+        self.curve = Curve.read_curve(file)
+        print('Consumer file read!')
+
+    # This function opens a binary file of the curve repository to set consumption values
+    # Values are not copied, they are read from the memory-mapped file
+    def open_consumption(self, file):
+        self.curve = CurveRepository.open_curve(file)
 
     # This function adds default values for a new producer
     def add_producer_values(self, priority_value=0, ratio_value=100):
@@ -45,13 +62,8 @@ class Consumer:
         self.ratio_list.append(ratio_value)
         print(f'Producer values added to consumer {self.name}: priority={priority_value}, ratio={ratio_value}')
 
-    # This function reads a stream
-    # def read_stream(self, stream):
-    #     cons_file = csv.reader(stream,delimiter=';')
-    #     for row in cons_file:
-    #         try:
-    #             self.point_list.append(Consumer.Point(row[0], float(row[1].replace(',','.'))))
-    #         except ValueError as e:
-    #             print('Erreur')
-    #         #print(row)
-    #     print('Stream read!')
\ No newline at end of file
+    # This function reads a stream (binary file object) to set consumption values
+    # The stream is parsed chunk by chunk, as it is read
+    def read_stream(self, stream):
+        self.curve = Curve.read_stream(stream, self.name)
+        print('Stream read!')
\ No newline at end of file
@@ -0,0 +1,372 @@
+# This module is to define Curve class and to read load curves files
+# A load curve file contains a title line, then one line per slot of 15 min:
+#   01/01/2024 00:00;2437        or        01.01. 00:00;3420,65
+import struct
+from collections.abc import Sequence
+
+import numpy as np
+
+# Formats of timestamps handled in load curves files
+# DAY_MONTH is used for simulated curves which are not linked to a specific year
+DAY_MONTH = '%d.%m. %H:%M'
+DAY_MONTH_YEAR = '%d/%m/%Y %H:%M'
+
+# Year used for curves without year, a leap year so that slots of 29.02 are valid
+DEFAULT_YEAR = 2024
+
+# Position of each character of timestamps for each format
+#   D: day, M: month, Y: year, h: hour, m: minute, other characters are separators
+TIMESTAMP_LAYOUT = {
+    DAY_MONTH: 'DD.MM. hh:mm',
+    DAY_MONTH_YEAR: 'DD/MM/YYYY hh:mm',
+}
+
+# Maximum number of malformed lines listed in error message
+MAX_ERRORS_REPORTED = 10
+
+# Size of chunks of data read from a stream (bytes)
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Characters ending a line, as in str.splitlines, except \r which may be followed by \n
+LINE_BREAKS = '\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# Binary format of curves, used to store curves without parsing them again:
+#   header: magic, version, index of date format, reserved, number of slots
+#   timestamps: int64 minutes since 1970-01-01, one per slot
+#   values: float64, one per slot
+# All fields are little-endian. Header is 24 bytes long so that arrays are aligned on 8 bytes.
+CURVE_MAGIC = b'RKCURVE\x00'
+CURVE_VERSION = 1
+CURVE_HEADER = struct.Struct('<8sHHIQ')
+# Date formats in binary format, stored as their index in the list
+DATE_FORMAT_LIST = [DAY_MONTH_YEAR, DAY_MONTH]
+
+
+# The following exception is raised when lines of a load curve file cannot be read
+class CurveFormatError(ValueError):
+
+    def __init__(self, name, error_list):
+        # Name of the file
+        self.name = name
+        # List of (line number, line, reason) for each malformed line
+        self.error_list = error_list
+
+        message = str(len(error_list)) + ' malformed line(s) in ' + str(name) + ': '
+        message += ', '.join('line ' + str(line_number) + ' (' + reason + ': ' + repr(line) + ')'
+                             for line_number, line, reason in error_list[:MAX_ERRORS_REPORTED])
+        if len(error_list) > MAX_ERRORS_REPORTED:
+            message += ', ...'
+        super().__init__(message)
+
+
+class Curve:
+
+    def __init__(self, timestamps, values, date_format=DAY_MONTH_YEAR):
+        # Timestamp of each slot of 15 min (datetime64 in minutes)
+        self.timestamps = timestamps
+        # Value of each slot (consumption or production)
+        self.values = values
+        # Format of timestamps in the file, used to write them back
+        self.date_format = date_format
+        # Hash identifying the curve in the curve repository, None for curves which are not in it
+        self.digest = None
+
+    def __len__(self):
+        return len(self.values)
+
+    # This function returns a curve without any slot
+    @staticmethod
+    def empty():
+        return Curve(np.zeros(0, dtype='datetime64[m]'), np.zeros(0), DAY_MONTH_YEAR)
+
+    # This function returns a curve built from a list of timestamps as text and a list of values
+    @staticmethod
+    def from_points(slot_list, value_list):
+        if not slot_list:
+            return Curve.empty()
+        date_format = get_date_format(slot_list[0])
+        if date_format is None:
+            raise CurveFormatError('', [(1, slot_list[0], 'unknown timestamp format')])
+        timestamps, error_list = parse_timestamps(slot_list, date_format)
+        if error_list:
+            raise CurveFormatError('', [(index + 1, slot_list[index], reason) for index, reason in error_list])
+        return Curve(timestamps, np.array(value_list, dtype=np.float64), date_format)
+
+    # This function returns timestamps as text, using the format of the file
+    def slot_list(self):
+        return format_timestamps(self.timestamps, self.date_format)
+
+    # This function returns the curve in binary format
+    def to_bytes(self):
+        header = CURVE_HEADER.pack(CURVE_MAGIC, CURVE_VERSION, DATE_FORMAT_LIST.index(self.date_format), 0, len(self))
+        return b''.join([header,
+                         np.asarray(self.timestamps, dtype='<M8[m]').tobytes(),
+                         np.asarray(self.values, dtype='<f8').tobytes()])
+
+    # This function returns a curve from binary format
+    # Arrays are read-only views on data, which is not copied
+    @staticmethod
+    def from_bytes(data):
+        if not is_curve_data(data):
+            raise ValueError('Data is not a binary curve')
+        _, version, format_index, _, count = CURVE_HEADER.unpack_from(data)
+        if version != CURVE_VERSION:
+            raise ValueError('Unsupported binary curve version: ' + str(version))
+        if format_index >= len(DATE_FORMAT_LIST) or len(data) != CURVE_HEADER.size + 16 * count:
+            raise ValueError('Corrupted binary curve')
+        timestamps = np.frombuffer(data, dtype='<M8[m]', count=count, offset=CURVE_HEADER.size)
+        values = np.frombuffer(data, dtype='<f8', count=count, offset=CURVE_HEADER.size + 8 * count)
+        return Curve(timestamps, values, DATE_FORMAT_LIST[format_index])
+
+
+# The following class gives access to a curve as a list of points
+# Points are built only when they are accessed
+class PointList(Sequence):
+
+    def __init__(self, curve, point_class):
+        self.curve = curve
+        # Class of points built, which takes the slot and the value
+        self.point_class = point_class
+
+    def __len__(self):
+        return len(self.curve)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(PointList(Curve(self.curve.timestamps[index], self.curve.values[index], self.curve.date_format),
+                                  self.point_class))
+        slot = self.curve.timestamps[index].astype(object).strftime(self.curve.date_format)
+        return self.point_class(slot, float(self.curve.values[index]))
+
+    def __iter__(self):
+        for slot, value in zip(self.curve.slot_list(), self.curve.values.tolist()):
+            yield self.point_class(slot, value)
+
+
+# This function returns true if data contains a curve in binary format
+def is_curve_data(data):
+    return len(data) >= CURVE_HEADER.size and bytes(data[:len(CURVE_MAGIC)]) == CURVE_MAGIC
+
+
+# This function returns the format of a timestamp
+def get_date_format(slot):
+    if '/' in slot:
+        return DAY_MONTH_YEAR
+    if '.' in slot:
+        return DAY_MONTH
+    return None
+
+
+# This function returns the values of digits at given positions of the layout
+# codes contains unicode value of each character of each timestamp (slots x characters)
+def get_field(codes, layout, letter):
+    value = np.zeros(codes.shape[0], dtype=np.int64)
+    for position, character in enumerate(layout):
+        if character == letter:
+            value = value * 10 + codes[:, position] - ord('0')
+    return value
+
+
+# This function converts timestamps from text to datetime64
+# It returns timestamps and a list of (index, reason) for timestamps which cannot be read
+def parse_timestamps(slot_list, date_format):
+    layout = TIMESTAMP_LAYOUT[date_format]
+    width = len(layout)
+
+    # Keep one more character to detect timestamps which are too long
+    codes = np.array(slot_list, dtype='U' + str(width + 1)).view(np.uint32).reshape(len(slot_list), width + 1)
+    valid = codes[:, width] == 0
+    codes = codes[:, :width].astype(np.int64)
+
+    # Check that each character is a digit or the expected separator
+    for position, character in enumerate(layout):
+        if character in 'DMYhm':
+            valid &= (codes[:, position] >= ord('0')) & (codes[:, position] <= ord('9'))
+        else:
+            valid &= codes[:, position] == ord(character)
+
+    day = get_field(codes, layout, 'D')
+    month = get_field(codes, layout, 'M')
+    year = get_field(codes, layout, 'Y') if 'Y' in layout else np.full(len(slot_list), DEFAULT_YEAR)
+    hour = get_field(codes, layout, 'h')
+    minute = get_field(codes, layout, 'm')
+
+    valid &= (month >= 1) & (month <= 12) & (hour < 24) & (minute < 60) & (day >= 1)
+    month = np.where(valid, month, 1)
+
+    month_start = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days_in_month = ((month_start + 1).astype('datetime64[D]') - month_start.astype('datetime64[D]')).astype(np.int64)
+    valid &= day <= days_in_month
+
+    timestamps = (month_start.astype('datetime64[D]').astype('datetime64[m]')
+                  + ((day - 1) * 24 * 60 + hour * 60 + minute).astype('timedelta64[m]'))
+
+    error_list = [(index, 'invalid timestamp') for index in np.flatnonzero(~valid).tolist()]
+    return timestamps, error_list
+
+
+# This function converts timestamps to text using the format of the file
+def format_timestamps(timestamps, date_format):
+    layout = TIMESTAMP_LAYOUT[date_format]
+    timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+
+    month_start = timestamps.astype('datetime64[M]')
+    minutes = (timestamps - month_start.astype('datetime64[m]')).astype(np.int64)
+    fields = {
+        'Y': month_start.astype('datetime64[Y]').astype(np.int64) + 1970,
+        'M': month_start.astype(np.int64) % 12 + 1,
+        'D': minutes // (24 * 60) + 1,
+        'h': minutes // 60 % 24,
+        'm': minutes % 60,
+    }
+
+    # Build unicode value of each character, starting from the last digit of each field
+    codes = np.zeros((len(timestamps), len(layout)), dtype=np.uint32)
+    remaining = {letter: value.copy() for letter, value in fields.items()}
+    for position in range(len(layout) - 1, -1, -1):
+        character = layout[position]
+        if character in remaining:
+            codes[:, position] = remaining[character] % 10 + ord('0')
+            remaining[character] //= 10
+        else:
+            codes[:, position] = ord(character)
+
+    return codes.view('U' + str(len(layout))).reshape(len(timestamps)).tolist()
+
+
+# The following class reads a load curve file chunk by chunk, as data is received
+# Complete lines of each chunk are parsed at once into arrays, the last line waits for the next chunk.
+# Malformed lines are collected while chunks are parsed, and reported when the file is finished.
+# Decimal comma is accepted. Lines are numbered from the title line.
+class CurveParser:
+
+    def __init__(self, name=''):
+        # Name of the file, used in error messages
+        self.name = name
+        # Last line received, which may be incomplete
+        self.pending = ''
+        # Number of lines parsed, including the title line
+        self.line_count = 0
+        # Format of timestamps, detected from the first slot
+        self.date_format = None
+        # Timestamps and values of each chunk
+        self.timestamps_list = []
+        self.values_list = []
+        # List of (line number, line, reason) for each malformed line
+        self.error_list = []
+
+    # This function reads data received from a file (bytes)
+    def feed(self, data):
+        # Load curves only contain ascii characters, except maybe in title line
+        self.feed_text(data.decode('latin-1'))
+
+    # This function reads text received from a file
+    def feed_text(self, text):
+        text = self.pending + text
+        # Last line waits for the next chunk, unless text ends with a line break
+        # A last \r is kept with the line, as it may be followed by \n in the next chunk
+        end = max(text.rfind(character) for character in LINE_BREAKS + '\r') + 1
+        if text.endswith(tuple(LINE_BREAKS)):
+            self.pending = ''
+        elif text.endswith('\r'):
+            end = max(text.rfind(character, 0, -1) for character in LINE_BREAKS + '\r') + 1
+            self.pending = text[end:]
+        else:
+            self.pending = text[end:]
+        self.parse_text(text[:end])
+
+    # This function parses text containing complete lines
+    def parse_text(self, text):
+        line_list = text.replace(',', '.').splitlines()
+        # Number of the first line of text in the file
+        text_number = self.line_count + 1
+        self.line_count += len(line_list)
+        first_number = text_number
+        # Skip first line of the file which contains title
+        if first_number == 1:
+            line_list = line_list[1:]
+            first_number = 2
+        if not line_list:
+            return
+
+        # Remove empty lines, keeping number of each line
+        # Lines containing only spaces are empty lines
+        number_list = list(range(first_number, len(line_list) + first_number))
+        if not all(map(str.strip, line_list)):
+            number_list = [line_number for line_number, line in enumerate(line_list, start=first_number) if line.strip()]
+            line_list = [line_list[line_number - first_number] for line_number in number_list]
+
+        # Split all lines at once when each line has exactly 2 columns
+        if all(line.count(';') == 1 for line in line_list):
+            cell_list = ';'.join(line_list).split(';')
+            slot_list = list(map(str.strip, cell_list[0::2]))
+            value_list = list(map(str.strip, cell_list[1::2]))
+        else:
+            slot_list = []
+            value_list = []
+            for line in line_list:
+                slot, _, value = line.partition(';')
+                slot_list.append(slot.strip())
+                value_list.append(value.partition(';')[0].strip())
+
+        if not slot_list:
+            return
+
+        # Auto-detect format of timestamps from the first slot of the file
+        if self.date_format is None:
+            self.date_format = get_date_format(slot_list[0])
+            if self.date_format is None:
+                raise CurveFormatError(self.name, [(number_list[0], text.splitlines()[number_list[0] - text_number],
+                                                    'unknown timestamp format')])
+
+        timestamps, error_list = parse_timestamps(slot_list, self.date_format)
+
+        try:
+            values = np.array(value_list, dtype=np.float64)
+        except ValueError:
+            # Find values which cannot be read
+            values = np.zeros(len(value_list))
+            for index, value in enumerate(value_list):
+                try:
+                    values[index] = float(value)
+                except ValueError:
+                    error_list.append((index, 'invalid value'))
+
+        if error_list:
+            error_list.sort()
+            text_line_list = text.splitlines()
+            self.error_list.extend((number_list[index], text_line_list[number_list[index] - text_number], reason)
+                                   for index, reason in error_list)
+        self.timestamps_list.append(timestamps)
+        self.values_list.append(values)
+
+    # This function parses the last line and returns the curve
+    def finish(self):
+        self.parse_text(self.pending)
+        self.pending = ''
+        if self.error_list:
+            raise CurveFormatError(self.name, self.error_list)
+        if not self.timestamps_list:
+            return Curve.empty()
+        return Curve(np.concatenate(self.timestamps_list), np.concatenate(self.values_list), self.date_format)
+
+
+# This function reads values of a load curve from text
+def parse_curve(text, name=''):
+    parser = CurveParser(name)
+    parser.feed_text(text)
+    return parser.finish()
+
+
+# This function reads a load curve file from a stream (binary file object), chunk by chunk
+def read_stream(stream, name=''):
+    parser = CurveParser(name)
+    for data in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+        parser.feed(data)
+    return parser.finish()
+
+
+# This function reads a load curve file
+def read_curve(file):
+    with open(file, 'rb') as curve_file:
+        return read_stream(curve_file, file)
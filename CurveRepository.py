@@ -0,0 +1,99 @@
+# This module is to define a repository of load curves stored in binary format
+# Each load curve file is converted once into a binary file (see Curve.to_bytes)
+# named after the hash of the content of the load curve file:
+#   - uploading again the same file does not parse it again
+#   - binary files are memory-mapped, so that several processes reading the same
+#     curve share the same pages and values are never copied
+# Uploaded files can be added from a stream: they are hashed and parsed chunk by chunk as they are read.
+import hashlib
+import os
+
+import numpy as np
+
+import Curve
+
+# Extension of binary files in the repository
+CURVE_EXTENSION = '.curve'
+
+
+class CurveRepository:
+
+    def __init__(self, folder):
+        # Folder containing binary files
+        self.folder = folder
+
+    # This function returns the path of the binary file of a curve
+    def get_path(self, digest):
+        return os.path.join(self.folder, digest + CURVE_EXTENSION)
+
+    # This function adds the content of a load curve file to the repository
+    # It returns the path of the binary file
+    def add_data(self, data, name=''):
+        path = self.get_path(hashlib.sha256(data).hexdigest())
+        if not os.path.exists(path):
+            self.write_curve(path, Curve.parse_curve(data.decode('latin-1'), name))
+        return path
+
+    # This function adds a load curve file read from a stream (binary file object)
+    # Content is hashed and parsed chunk by chunk, it is never loaded at once in memory.
+    # If raw_file is given, the content is also copied into this file, only when the curve is valid.
+    # It returns the path of the binary file
+    def add_stream(self, stream, name='', raw_file=None):
+        digest = hashlib.sha256()
+        parser = Curve.CurveParser(name)
+        # The copy is written in a temporary file, so that an invalid file never replaces raw_file
+        temp_raw_file = raw_file + '.' + str(os.getpid()) + '.tmp' if raw_file is not None else None
+        raw = open(temp_raw_file, 'wb') if raw_file is not None else None
+        try:
+            try:
+                for data in iter(lambda: stream.read(Curve.STREAM_CHUNK_SIZE), b''):
+                    digest.update(data)
+                    parser.feed(data)
+                    if raw is not None:
+                        raw.write(data)
+            finally:
+                if raw is not None:
+                    raw.close()
+
+            path = self.get_path(digest.hexdigest())
+            # A curve already in the repository has been checked when it was added
+            if not os.path.exists(path):
+                self.write_curve(path, parser.finish())
+        except BaseException:
+            if raw is not None:
+                os.remove(temp_raw_file)
+            raise
+
+        if raw is not None:
+            os.replace(temp_raw_file, raw_file)
+        return path
+
+    # This function writes the binary file of a curve
+    def write_curve(self, path, curve):
+        os.makedirs(self.folder, exist_ok=True)
+        # Write a temporary file first so that other processes never open a partial file
+        temp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(temp_path, 'wb') as curve_file:
+            curve_file.write(curve.to_bytes())
+        os.replace(temp_path, path)
+
+    # This function adds a load curve file to the repository
+    # It returns the path of the binary file
+    def add_file(self, file):
+        with open(file, 'rb') as curve_file:
+            data = curve_file.read()
+        return self.add_data(data, file)
+
+
+# This function returns true if the file is a binary file of the repository
+def is_curve_file(file):
+    return bool(file) and file.endswith(CURVE_EXTENSION)
+
+
+# This function opens a binary file of the repository
+# Values of the curve are read-only views on the memory-mapped file
+# The digest of the curve is the hash of the load curve file, given by the name of the binary file
+def open_curve(file):
+    curve = Curve.Curve.from_bytes(np.memmap(file, dtype=np.uint8, mode='r'))
+    curve.digest = os.path.basename(file)[:-len(CURVE_EXTENSION)]
+    return curve
@@ -0,0 +1,423 @@
+# This module is to define vectorized engines computing repartition keys
+# Engines work on the whole set of slots at once instead of one Point at a time:
+#   cons is a (slots x consumers) matrix of consumption
+#   prod is a (slots x producers) matrix of production
+# They return keys and auto_consumption as (slots x consumers x producers) arrays.
+#
+# Sums are accumulated column by column in the same order as the object based
+# implementation in Repartition so that floating point results, and therefore the
+# floor rounding of keys, are identical.
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Start method of worker processes
+# Processes are started from threads of the server: a forked child could wait forever on a lock held by
+# another thread at fork time (logging, database pool, ...), so workers are started from a clean process
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+# This function sums the columns of a matrix one after the other
+# It reproduces the sequential sum done in python loops (numpy sum uses pairwise summation)
+def sequential_sum(matrix):
+    total = np.zeros(matrix.shape[0])
+    for index in range(matrix.shape[1]):
+        total += matrix[:, index]
+    return total
+
+
+# This function sums all values one after the other, in row-major order, starting from initial
+# It gives the same result as summing values in python loops
+def sequential_total(values, initial=0.0):
+    values = np.ravel(values)
+    if values.size == 0:
+        return float(initial)
+    if initial != 0:
+        values = np.concatenate(([initial], values))
+    return float(np.add.accumulate(values)[-1])
+
+
+# This function returns a pool of worker processes, started with START_METHOD
+def create_executor(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+
+# This function returns the rate of part compared to total, in percent rounded down to 0.1
+def get_rate(part, total):
+    return int(part * 1000 / total) / 10
+
+
+# This function converts auto_consumption into final keys
+# Use floor function to round to lower value.
+# This ensures that sum of all keys does not exceed 100%
+def floor_keys(auto_consumption, initial_production):
+    initial_production = initial_production[:, np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        key = np.floor(auto_consumption * 1000 / initial_production) / 10
+    # A producer without production cannot give any key
+    key[np.broadcast_to(initial_production == 0, key.shape)] = 0
+    return key
+
+
+# This function computes keys for Strategy.DYNAMIC_BY_DEFAULT on all slots
+# Keys are based on consumption of each consumer compared to global consumption
+def compute_dynamic_by_default(cons, prod):
+    cons = np.asarray(cons, dtype=np.float64)
+    prod = np.asarray(prod, dtype=np.float64)
+
+    global_consumption = sequential_sum(cons)
+    global_production = sequential_sum(prod)
+
+    # Compute ratio between global_consumption and global production
+    # Limit value to 1 to not exceed the consumption
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_conso_prod = np.where(global_consumption > global_production,
+                                    1.0,
+                                    global_consumption / global_production)
+        key = np.where(global_consumption[:, np.newaxis] != 0,
+                       cons / global_consumption[:, np.newaxis],
+                       0.0)
+
+        auto_consumption = prod[:, np.newaxis, :] * key[:, :, np.newaxis] * ratio_conso_prod[:, np.newaxis, np.newaxis]
+    auto_consumption[global_consumption == 0] = 0
+
+    return floor_keys(auto_consumption, prod), auto_consumption
+
+
+# States of consumers while computing DYNAMIC keys
+# Same values as Repartition.State
+ACTIVE = 1
+INACTIVE = 2
+COMPLETE = 3
+
+# Number of slots computed together by the DYNAMIC solver
+BATCH_SIZE = 4096
+
+# Maximum number of redistribution rounds for one priority
+# Same order of magnitude as the recursion limit hit by the recursive implementation
+MAX_ROUNDS = 1000
+
+
+# The following class solves Strategy.DYNAMIC on a batch of slots
+#
+# It reproduces Repartition.calculate_rep_key_dynamic without recursion.
+# For one priority, the recursive function is equivalent to:
+#   - distribute production to consumers, then redistribute remaining production
+#     to consumers still active, as many rounds as needed
+#   - then, once per round: re-activate consumers, compute the next priority
+#     and compute final keys
+# Each frame of the explicit stack below handles one priority for a set of slots.
+# Slots are independent: every operation is applied to all slots of a frame at once.
+class DynamicSolver:
+
+    # Class describing the computation of one priority for a set of slots
+    class Frame:
+        def __init__(self, priority, slot_index, round_count):
+            self.priority = priority
+            # Index of slots computed by the frame
+            self.slot_index = slot_index
+            # Number of distribution rounds done for each slot
+            self.round_count = round_count
+            # Number of times next priority has been computed
+            self.iteration = 0
+            # Slots waiting for next priority to be computed before computing final keys
+            self.pending = None
+
+    def __init__(self, cons, prod, priority, key):
+        self.consumption = cons
+        self.initial_production = prod
+        self.production = prod.copy()
+        # Priority of each consumer for each producer (consumers x producers)
+        self.priority = priority
+        # Keys are initialized with ratio of each consumer
+        self.key = key.copy()
+        self.auto_consumption = np.zeros(key.shape)
+        self.state = np.full(cons.shape, ACTIVE, dtype=np.int8)
+        # Number of distribution rounds of each slot, for all priorities, and deepest priority computed
+        self.rounds = np.zeros(cons.shape[0], dtype=np.int64)
+        self.max_depth = 0
+
+    # This function returns true if at least one consumer has the priority
+    def priority_exist(self, priority):
+        return bool((self.priority == priority).any())
+
+    # This function assigns production to consumers having the priority, for all given slots
+    def distribute(self, priority, slot_index):
+        match = self.priority == priority
+        # priority_exist becomes true from the first consumer having the priority
+        priority_exist = np.logical_or.accumulate(match.any(axis=1))
+
+        cons = self.consumption[slot_index]
+        production = self.production[slot_index]
+        key = self.key[slot_index]
+        auto_consumption = self.auto_consumption[slot_index]
+        state = self.state[slot_index]
+
+        active = state == ACTIVE
+        state[active & ~priority_exist] = INACTIVE
+        active &= priority_exist
+
+        prod_total = np.zeros(cons.shape)
+        for index_prod in np.flatnonzero(match.any(axis=0)):
+            prod_total += np.where(match[:, index_prod],
+                                   (production[:, index_prod, np.newaxis] * key[:, :, index_prod]) / 100,
+                                   0.0)
+
+        # No production to use anymore with this priority => de-activate the consumer
+        state[active & (prod_total == 0)] = INACTIVE
+
+        # Get current auto_consumption used from all producers
+        auto_consumption_total = np.zeros(cons.shape)
+        for index_prod in range(auto_consumption.shape[2]):
+            auto_consumption_total += auto_consumption[:, :, index_prod]
+
+        # Check if consumption from autocollect is going to exceed consumption
+        # If this is the case, set consumer to COMPLETE state
+        complete = active & (cons < prod_total + auto_consumption_total)
+        state[complete] = COMPLETE
+        with np.errstate(all='ignore'):
+            remaining_ratio = np.where(prod_total != 0, (cons - auto_consumption_total) / prod_total, 0.0)
+
+        prod_to_remove = np.zeros(production.shape)
+        for index_prod in np.flatnonzero(match.any(axis=0)):
+            prod_slot = production[:, index_prod, np.newaxis]
+            key_prod = key[:, :, index_prod]
+            # Complete consumers get the part of production matching their remaining consumption
+            # Others get production according to the key
+            with np.errstate(all='ignore'):
+                new_prod = np.where(complete,
+                                    prod_slot * (key_prod / 100) * remaining_ratio,
+                                    (key_prod * prod_slot) / 100)
+            new_prod = np.where(active & match[:, index_prod], new_prod, 0.0)
+            auto_consumption[:, :, index_prod] += new_prod
+            prod_to_remove[:, index_prod] = sequential_sum(new_prod)
+
+        # Refresh production by removing what has been consumed by consumers
+        production -= prod_to_remove
+
+        self.production[slot_index] = production
+        self.auto_consumption[slot_index] = auto_consumption
+        self.state[slot_index] = state
+
+        # Production is redistributed if not all the production is used,
+        # and at least one consumer still enabled
+        if not match.any():
+            return np.zeros(len(slot_index), dtype=bool)
+        return (sequential_sum(production) > 0) & (state == ACTIVE).any(axis=1)
+
+    # This function computes new ratios of active consumers so that they share all remaining production
+    def compute_new_ratio(self, priority, slot_index):
+        match = self.priority == priority
+        key = self.key[slot_index]
+        active = self.state[slot_index] == ACTIVE
+
+        for index_prod in np.flatnonzero(match.any(axis=0)):
+            # Sum ratio of all enabled consumers
+            used = active & match[:, index_prod]
+            new_sum = sequential_sum(np.where(used, key[:, :, index_prod], 0.0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                new_key = (100 * key[:, :, index_prod]) / new_sum[:, np.newaxis]
+            key[:, :, index_prod] = np.where(used & (new_sum[:, np.newaxis] != 0), new_key, key[:, :, index_prod])
+
+        self.key[slot_index] = key
+
+    # This function re-activates consumers of slots where no consumer is active anymore
+    def reactivate(self, slot_index):
+        state = self.state[slot_index]
+        no_active = ~(state == ACTIVE).any(axis=1)
+        state[no_active[:, np.newaxis] & (state == INACTIVE)] = ACTIVE
+        self.state[slot_index] = state
+
+    # This function computes final keys from auto_consumption
+    def compute_final_keys(self, slot_index):
+        self.key[slot_index] = floor_keys(self.auto_consumption[slot_index], self.initial_production[slot_index])
+
+    # This function starts computation of a priority for a set of slots
+    # Production is distributed as many rounds as needed, then a frame is returned
+    # to compute next priority once per round
+    def start_frame(self, priority, slot_index):
+        round_count = np.zeros(len(slot_index), dtype=np.int64)
+        running = np.arange(len(slot_index))
+        while len(running) > 0:
+            if round_count[running[0]] >= MAX_ROUNDS:
+                raise RuntimeError('DYNAMIC keys did not converge after ' + str(MAX_ROUNDS) + ' rounds')
+            redistribute = self.distribute(priority, slot_index[running])
+            round_count[running] += 1
+            running = running[redistribute]
+            self.compute_new_ratio(priority, slot_index[running])
+        self.rounds[slot_index] += round_count
+        self.max_depth = max(self.max_depth, priority)
+        return DynamicSolver.Frame(priority, slot_index, round_count)
+
+    # This function returns the slots where computing a priority can still change auto_consumption:
+    # some production is left and at least one consumer is not complete
+    def slots_to_compute(self, slot_index):
+        production_left = (self.production[slot_index] != 0).any(axis=1)
+        consumer_left = (self.state[slot_index] != COMPLETE).any(axis=1)
+        return slot_index[production_left & consumer_left]
+
+    # This function computes keys for all slots, starting with priority 0
+    def solve(self):
+        slot_index = np.arange(self.consumption.shape[0])
+        stack = [self.start_frame(0, slot_index)]
+
+        while stack:
+            frame = stack[-1]
+
+            # Next priority has been computed => compute final keys
+            if frame.pending is not None:
+                self.compute_final_keys(frame.pending)
+                frame.pending = None
+
+            slot_index = frame.slot_index[frame.round_count > frame.iteration]
+            if len(slot_index) == 0:
+                stack.pop()
+                continue
+            frame.iteration += 1
+
+            self.reactivate(slot_index)
+            if self.priority_exist(frame.priority):
+                frame.pending = slot_index
+                # Slots without production or consumption left are not changed by next priority
+                # They only need final keys to be computed
+                next_slot_index = self.slots_to_compute(slot_index)
+                if len(next_slot_index) > 0:
+                    stack.append(self.start_frame(frame.priority + 1, next_slot_index))
+            else:
+                self.compute_final_keys(slot_index)
+
+        return self.key, self.auto_consumption
+
+
+# This function computes keys for Strategy.DYNAMIC on all slots
+# Keys are based on priority (consumers x producers) and initial ratio (slots x consumers x producers)
+# Slots are computed by batches to limit memory used
+# progress is called after each batch with the number of slots computed and the total number of slots
+# If stats is given, it is filled with the number of distribution rounds of each slot ('rounds')
+# and the deepest priority computed ('max_depth')
+def compute_dynamic(cons, prod, priority, ratio, batch_size=BATCH_SIZE, progress=None, stats=None):
+    cons = np.asarray(cons, dtype=np.float64)
+    prod = np.asarray(prod, dtype=np.float64)
+    priority = np.asarray(priority)
+    ratio = np.asarray(ratio, dtype=np.float64)
+
+    key = np.zeros(ratio.shape)
+    auto_consumption = np.zeros(ratio.shape)
+    rounds = np.zeros(cons.shape[0], dtype=np.int64)
+    max_depth = 0
+    for start in range(0, cons.shape[0], batch_size):
+        stop = start + batch_size
+        solver = DynamicSolver(cons[start:stop], prod[start:stop], priority, ratio[start:stop])
+        key[start:stop], auto_consumption[start:stop] = solver.solve()
+        rounds[start:stop] = solver.rounds
+        max_depth = max(max_depth, solver.max_depth)
+        if progress is not None:
+            progress(min(stop, cons.shape[0]), cons.shape[0])
+
+    if stats is not None:
+        stats['rounds'] = rounds
+        stats['max_depth'] = max_depth
+    return key, auto_consumption
+
+
+# This function copies an array into a new block of shared memory
+# It returns the block, the array using the block and the description used by other processes to open it
+def share_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=np.float64, buffer=block.buf)
+    shared[...] = array
+    return block, shared, (block.name, array.shape)
+
+
+# This function opens an array shared by another process
+def open_shared_array(description):
+    name, shape = description
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+# This function computes keys of slots [start, stop[ in a worker process
+# Inputs and outputs are arrays in shared memory: results are written in place
+# It returns the number of slots computed and the deepest priority computed
+def compute_chunk(description_dict, priority, start, stop):
+    block_list = []
+    array_dict = {}
+    try:
+        for name, description in description_dict.items():
+            block, array_dict[name] = open_shared_array(description)
+            block_list.append(block)
+
+        cons = array_dict['cons'][start:stop]
+        prod = array_dict['prod'][start:stop]
+        stats = {'max_depth': 0}
+        if priority is None:
+            key, auto_consumption = compute_dynamic_by_default(cons, prod)
+        else:
+            key, auto_consumption = compute_dynamic(cons, prod, priority, array_dict['ratio'][start:stop], stats=stats)
+            array_dict['rounds'][start:stop] = stats['rounds']
+        array_dict['key'][start:stop] = key
+        array_dict['auto_consumption'][start:stop] = auto_consumption
+    finally:
+        # Arrays must be released before closing the blocks they use
+        array_dict.clear()
+        for block in block_list:
+            block.close()
+    return stop - start, stats['max_depth']
+
+
+# This function computes keys on several processes, each one computing a chunk of slots
+# Slots are independent, so results are identical to the ones computed on one process.
+# Strategy.DYNAMIC_BY_DEFAULT is used when priority is None, Strategy.DYNAMIC otherwise.
+# progress is called after each chunk with the number of slots computed and the total number of slots
+# stats is filled as by compute_dynamic when Strategy.DYNAMIC is used
+def compute_parallel(cons, prod, priority=None, ratio=None, workers=None, chunk_size=BATCH_SIZE, progress=None,
+                     stats=None):
+    cons = np.asarray(cons, dtype=np.float64)
+    prod = np.asarray(prod, dtype=np.float64)
+    nb_slot = cons.shape[0]
+    shape = (nb_slot, cons.shape[1], prod.shape[1])
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    array_dict = {'cons': cons, 'prod': prod, 'key': np.zeros(shape), 'auto_consumption': np.zeros(shape)}
+    if priority is not None:
+        priority = np.asarray(priority)
+        array_dict['ratio'] = np.broadcast_to(np.asarray(ratio, dtype=np.float64), shape)
+        array_dict['rounds'] = np.zeros(nb_slot)
+
+    block_list = []
+    shared_dict = {}
+    description_dict = {}
+    try:
+        for name, array in array_dict.items():
+            block, shared_dict[name], description_dict[name] = share_array(array)
+            block_list.append(block)
+
+        slots_computed = 0
+        max_depth = 0
+        with create_executor(workers) as executor:
+            future_list = [executor.submit(compute_chunk, description_dict, priority, start, min(start + chunk_size, nb_slot))
+                           for start in range(0, nb_slot, chunk_size)]
+            for future in as_completed(future_list):
+                chunk_slots, chunk_depth = future.result()
+                slots_computed += chunk_slots
+                max_depth = max(max_depth, chunk_depth)
+                if progress is not None:
+                    progress(slots_computed, nb_slot)
+
+        key = shared_dict['key'].copy()
+        auto_consumption = shared_dict['auto_consumption'].copy()
+        if stats is not None and priority is not None:
+            stats['rounds'] = shared_dict['rounds'].astype(np.int64)
+            stats['max_depth'] = max_depth
+    finally:
+        shared_dict.clear()
+        for block in block_list:
+            block.close()
+            block.unlink()
+
+    return key, auto_consumption
@@ -0,0 +1,514 @@
+# This module is to define the export of repartition results
+# Results are read once, by chunks of slots, and each chunk is given to every sink:
+#   KeySink:          one file of repartition keys per producer
+#   StatisticsSink:   one file of statistics (auto-consumption and auto-production) per producer
+#   MonthlyReportSink: one monthly report per producer
+#   AggregateSink:    one report per resolution (ISO week, day, hour) of consumption, auto-consumption
+#                     and rates of each consumer and each producer
+#   IndicatorSink:    global indicators (auto-consumption, auto-production and coverage rates)
+#   ColumnarSink:     one Parquet or Arrow IPC file per producer, with typed columns (needs pyarrow)
+# Files are written through large buffers, so that export time only depends once on data size.
+#
+# Values are computed and formatted the same way as the slot by slot implementation, so that
+# files are identical. Sums are accumulated sequentially, in the same order.
+import csv
+
+import numpy as np
+
+# pyarrow is optional, it is only needed by ColumnarSink
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import Aggregation
+import Curve
+import Engine
+
+# Number of slots read at once
+CHUNK_SIZE = 4096
+
+# Size of buffer of each file written (bytes)
+BUFFER_SIZE = 1024 * 1024
+
+# Formats of columnar files
+PARQUET = 'parquet'
+ARROW = 'arrow'
+
+COLUMNAR_FORMAT_LIST = [PARQUET, ARROW]
+
+# Resolutions of reports written by AggregateSink
+AGGREGATE_RESOLUTION_LIST = [Aggregation.WEEK, Aggregation.DAY, Aggregation.HOUR]
+
+
+# This function opens a csv file to write and returns the file and its writer
+def open_csv(file):
+    csvfile = open(file, 'w', newline='', buffering=BUFFER_SIZE)
+    return csvfile, csv.writer(csvfile, delimiter=';')
+
+
+# This function formats values with ',' as decimal separator
+def format_values(values):
+    return [str(value).replace('.', ',') for value in values.tolist()]
+
+
+# This function formats keys of slots (slots x consumers), all keys of the chunk at once:
+# computed keys are written with ',' instead of '.', keys of slots not computed are the initial
+# ratios, written as integers
+def format_keys(key, computed):
+    int_key_list = np.trunc(key).astype(np.int64).tolist()
+    return [[value.replace('.', ',') for value in map(str, key_slot)] if computed_slot else list(map(str, int_key_slot))
+            for key_slot, int_key_slot, computed_slot in zip(key.tolist(), int_key_list, computed.tolist())]
+
+
+# This function returns true if columnar files can be written
+def is_columnar_available():
+    return pyarrow is not None
+
+
+# The following class gives access to results of a chunk of slots
+class Chunk:
+
+    def __init__(self, rep, start, stop):
+        self.start = start
+        self.stop = stop
+        self.timestamps = rep.timestamps[start:stop]
+        # Timestamps of slots as text
+        self.slot_list = Curve.format_timestamps(self.timestamps, rep.date_format)
+        self.computed = rep.computed[start:stop]
+        self.consumption = rep.consumption[start:stop]
+        self.initial_production = rep.initial_production[start:stop]
+        # Keys and auto_consumption of slots which are not stored are filled in
+        self.key = rep.get_key(start, stop)
+        self.auto_consumption = rep.get_auto_consumption(start, stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+
+# The following class is the base class of sinks
+# A sink is started with the repartition, receives each chunk of slots, then is finished
+class Sink:
+
+    def start(self, rep, prod_list, cons_list):
+        pass
+
+    def write(self, chunk):
+        pass
+
+    # This function returns what has been produced by the sink
+    def finish(self):
+        return None
+
+
+# The following class writes one file of repartition keys per producer
+class KeySink(Sink):
+
+    def __init__(self, folder, debug_info=False):
+        self.folder = folder
+        # Add formulas checking that sum of keys does not exceed 100%
+        self.debug_info = debug_info
+        self.file_list = []
+        self.csvfile_list = []
+        self.writer_list = []
+
+    def start(self, rep, prod_list, cons_list):
+        nb_cons = len(rep.prm_list)
+
+        # Formulas of debug information, completed with the line number of each slot
+        # Column A contains Horodate, then one column per consumer, then TOTAL
+        self.sum_formula = '=SOMME(' + ';'.join('SUBSTITUE(' + chr(ord('A') + index_cons + 1) + '{0};".";",")'
+                                                for index_cons in range(nb_cons)) + ')'
+        self.check_formula = '=SI(' + chr(ord('A') + nb_cons + 1) + '{0}>100;"NOK";"")'
+
+        for prod in prod_list:
+            file = self.folder + str(prod.prm) + '.csv'
+            csvfile, keywriter = open_csv(file)
+            self.file_list.append(file)
+            self.csvfile_list.append(csvfile)
+            self.writer_list.append(keywriter)
+
+            # Add first line with list of PRM
+            first_line = ['Horodate'] + [str(prm) for prm in rep.prm_list]
+            if self.debug_info:
+                first_line.append('TOTAL')
+                column_letter = chr(ord('A') + nb_cons + 2)
+                last_line = str(len(rep.timestamps) + 1)
+                first_line.append('=NB.SI(' + column_letter + '2:' + column_letter + last_line + ';"NOK")')
+            keywriter.writerow(first_line)
+
+    def write(self, chunk):
+        for index_prod, keywriter in enumerate(self.writer_list):
+            row_list = [[slot] + key_slot
+                        for slot, key_slot in zip(chunk.slot_list, format_keys(chunk.key[:, :, index_prod], chunk.computed))]
+
+            if self.debug_info:
+                # First slot is written on second line of the file
+                for line_number, row_key in enumerate(row_list, start=chunk.start + 2):
+                    row_key.append(self.sum_formula.format(line_number))
+                    row_key.append(self.check_formula.format(line_number))
+
+            keywriter.writerows(row_list)
+
+    def finish(self):
+        for csvfile in self.csvfile_list:
+            csvfile.close()
+            print('Repartition key file written')
+        return self.file_list
+
+
+# The following class writes one file of statistics per producer
+class StatisticsSink(Sink):
+
+    def __init__(self, folder, add_cons=False, add_auto_cons=True, add_auto_prod_rate=False):
+        self.folder = folder
+        self.add_cons = add_cons
+        self.add_auto_cons = add_auto_cons
+        self.add_auto_prod_rate = add_auto_prod_rate
+        self.file_list = []
+        self.csvfile_list = []
+        self.writer_list = []
+
+    def start(self, rep, prod_list, cons_list):
+        for prod in prod_list:
+            file = self.folder + str(prod.prm) + '_statistics.csv'
+            csvfile, keywriter = open_csv(file)
+            self.file_list.append(file)
+            self.csvfile_list.append(csvfile)
+            self.writer_list.append(keywriter)
+
+            # Add first line with name of consumers
+            first_line = ['Horodate', prod.name]
+            for cons in cons_list:
+                if self.add_cons: first_line.append(cons.name + "\ncons")
+                if self.add_auto_cons: first_line.append(cons.name + "\nauto_cons")
+                if self.add_auto_prod_rate: first_line.append(cons.name + "\nauto_prod_rate")
+            first_line.append("auto_cons_rate")
+            keywriter.writerow(first_line)
+
+    def write(self, chunk):
+        consumption = chunk.consumption
+        consumption_column_list = [format_values(consumption[:, index_cons])
+                                   for index_cons in range(consumption.shape[1])] if self.add_cons else []
+
+        for index_prod, keywriter in enumerate(self.writer_list):
+            initial_production = chunk.initial_production[:, index_prod]
+            key = chunk.key[:, :, index_prod]
+            auto_cons = np.floor(initial_production[:, np.newaxis] * key) / 100
+
+            # Multiply by 100 and force to int to prevent having float representation issues
+            total_auto_consumption = np.rint(chunk.auto_consumption[:, :, index_prod] * 100).astype(np.int64).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                auto_cons_ratio = np.where(initial_production != 0,
+                                           np.trunc(total_auto_consumption / initial_production),
+                                           0).astype(np.int64)
+                auto_prod_rate = np.trunc(auto_cons * 100 / consumption)
+
+            # Columns of the file, in the same order as the first line
+            column_list = [chunk.slot_list, [str(value) for value in initial_production.tolist()]]
+            for index_cons in range(consumption.shape[1]):
+                if self.add_cons:
+                    column_list.append(consumption_column_list[index_cons])
+                if self.add_auto_cons:
+                    column_list.append(format_values(auto_cons[:, index_cons]))
+                if self.add_auto_prod_rate:
+                    column_list.append([str(int(rate)) if cons != 0 else 0
+                                        for rate, cons in zip(auto_prod_rate[:, index_cons].tolist(),
+                                                              consumption[:, index_cons].tolist())])
+            column_list.append(auto_cons_ratio.tolist())
+
+            keywriter.writerows(zip(*column_list))
+
+    def finish(self):
+        for csvfile in self.csvfile_list:
+            csvfile.close()
+            print('File for statistics generated')
+        return self.file_list
+
+
+# The following class writes one monthly report per producer
+class MonthlyReportSink(Sink):
+
+    def __init__(self, folder, add_cons_mois=True, add_auto_prod_rate=True, add_auto_cons_mois=True):
+        self.folder = folder
+        self.add_cons_mois = add_cons_mois
+        self.add_auto_prod_rate = add_auto_prod_rate
+        self.add_auto_cons_mois = add_auto_cons_mois
+        self.file_list = []
+        self.csvfile_list = []
+        self.writer_list = []
+
+    def start(self, rep, prod_list, cons_list):
+        nb_cons = rep.consumption.shape[1]
+        for prod in prod_list:
+            file = self.folder + str(prod.prm) + '_monthly_report.csv'
+            csvfile, keywriter = open_csv(file)
+            self.file_list.append(file)
+            self.csvfile_list.append(csvfile)
+            self.writer_list.append(keywriter)
+
+            # Add first line with name of consumers
+            first_line = ['Horodate', prod.name + '\n prod']
+            for cons in cons_list:
+                if self.add_cons_mois: first_line.append(cons.name + '\ncons_mois')
+                if self.add_auto_prod_rate: first_line.append(cons.name + '\nauto_prod_rate')
+                if self.add_auto_cons_mois: first_line.append(cons.name + '\nauto_cons_mois')
+            keywriter.writerow(first_line)
+
+        # Values of the current month, which may continue in next chunk
+        # Production of the first producer is used for all reports
+        self.current_month = None
+        self.last_slot = None
+        self.prod_month = 0.0
+        self.cons_month = np.zeros(nb_cons)
+        self.auto_cons_month = np.zeros((nb_cons, len(prod_list)))
+
+    def write(self, chunk):
+        month = Aggregation.get_period(chunk.timestamps, Aggregation.MONTH)
+        slot_list = chunk.slot_list
+        production = chunk.initial_production[:, 0]
+        consumption = chunk.consumption
+        auto_cons = (chunk.initial_production[:, np.newaxis, :] * chunk.key) / 100
+
+        # Values of the current month are added as a first slot, so that sums continue from them
+        if self.current_month is not None:
+            month = np.concatenate(([self.current_month], month))
+            slot_list = [self.last_slot] + slot_list
+            production = np.concatenate(([self.prod_month], production))
+            consumption = np.vstack([self.cons_month[np.newaxis], consumption])
+            auto_cons = np.concatenate([self.auto_cons_month[np.newaxis], auto_cons])
+
+        month_list, last_index, (prod_month, cons_month, auto_cons_month) = Aggregation.aggregate(
+            month, [production, consumption, auto_cons])
+
+        # All months are complete except the last one
+        for index_month in range(len(month_list)):
+            self.last_slot = slot_list[last_index[index_month]]
+            self.prod_month = float(prod_month[index_month])
+            self.cons_month = cons_month[index_month]
+            self.auto_cons_month = auto_cons_month[index_month]
+            if index_month < len(month_list) - 1:
+                self.write_month()
+        self.current_month = month_list[-1] if len(month_list) > 0 else self.current_month
+
+    # This function writes values of the current month in each report, then reinitializes them
+    def write_month(self):
+        for index_prod, keywriter in enumerate(self.writer_list):
+            row_key = [self.last_slot, str(int(self.prod_month / 1000)).replace('.', ',')]
+            for cons_month, auto_cons_month in zip(self.cons_month.tolist(), self.auto_cons_month[:, index_prod].tolist()):
+                if self.add_cons_mois:
+                    row_key.append(str(int(cons_month / 1000)).replace('.', ','))
+                if self.add_auto_prod_rate:
+                    ratio = int(auto_cons_month * 10000 / cons_month) / 100
+                    row_key.append(str(ratio).replace('.', ','))
+                if self.add_auto_cons_mois:
+                    row_key.append(str(int(auto_cons_month / 1000)).replace('.', ','))
+            keywriter.writerow(row_key)
+
+        self.prod_month = 0.0
+        self.cons_month = np.zeros(self.cons_month.shape)
+        self.auto_cons_month = np.zeros(self.auto_cons_month.shape)
+
+    def finish(self):
+        # Write values of last month
+        if self.current_month is not None:
+            self.write_month()
+        for csvfile in self.csvfile_list:
+            csvfile.close()
+            print('Monthly report generated')
+        return self.file_list
+
+
+# The following class writes one report per resolution, with a line per period:
+#   Horodate (start of the period), then for each producer: production and auto_cons_rate,
+#   then for each consumer: consumption, auto_consumption from all producers and auto_prod_rate
+# Rates are in percent, rounded to 0.01
+class AggregateSink(Sink):
+
+    def __init__(self, folder, resolution_list=AGGREGATE_RESOLUTION_LIST):
+        for resolution in resolution_list:
+            if resolution not in Aggregation.RESOLUTION_LIST:
+                raise ValueError('Unknown resolution: ' + str(resolution))
+        self.folder = folder
+        self.resolution_list = resolution_list
+        self.file_list = []
+        self.csvfile_list = []
+        self.writer_list = []
+
+    def start(self, rep, prod_list, cons_list):
+        self.date_format = rep.date_format
+        for resolution in self.resolution_list:
+            file = self.folder + 'aggregate_' + resolution + '.csv'
+            csvfile, keywriter = open_csv(file)
+            self.file_list.append(file)
+            self.csvfile_list.append(csvfile)
+            self.writer_list.append(keywriter)
+
+            first_line = ['Horodate']
+            for prod in prod_list:
+                first_line += [prod.name + '\nprod', prod.name + '\nauto_cons_rate']
+            for cons in cons_list:
+                first_line += [cons.name + '\ncons', cons.name + '\nauto_cons', cons.name + '\nauto_prod_rate']
+            keywriter.writerow(first_line)
+
+        # Values of the current period of each resolution, which may continue in next chunk
+        self.current_list = [None] * len(self.resolution_list)
+
+    def write(self, chunk):
+        for index_resolution, resolution in enumerate(self.resolution_list):
+            period = Aggregation.get_period(chunk.timestamps, resolution)
+            production = chunk.initial_production
+            consumption = chunk.consumption
+            auto_consumption = chunk.auto_consumption
+
+            # Values of the current period are added as a first slot, so that sums continue from them
+            current = self.current_list[index_resolution]
+            if current is not None:
+                period = np.concatenate(([current.period_list[0]], period))
+                production = np.concatenate([current.production, production])
+                consumption = np.concatenate([current.consumption, consumption])
+                auto_consumption = np.concatenate([current.auto_consumption, auto_consumption])
+
+            period_list, _, (production, consumption, auto_consumption) = Aggregation.aggregate(
+                period, [production, consumption, auto_consumption])
+            if len(period_list) == 0:
+                continue
+
+            # All periods are complete except the last one
+            self.write_aggregate(index_resolution, Aggregation.Aggregate(
+                period_list[:-1], production[:-1], consumption[:-1], auto_consumption[:-1]))
+            self.current_list[index_resolution] = Aggregation.Aggregate(
+                period_list[-1:], production[-1:], consumption[-1:], auto_consumption[-1:])
+
+    # This function writes a line per period of an aggregate in the report of a resolution
+    def write_aggregate(self, index_resolution, aggregate):
+        if len(aggregate.period_list) == 0:
+            return
+        column_list = [Curve.format_timestamps(aggregate.period_list, self.date_format)]
+        auto_consumption_rate = np.round(aggregate.get_auto_consumption_rate(), 2)
+        for index_prod in range(aggregate.production.shape[1]):
+            column_list.append(format_values(aggregate.production[:, index_prod]))
+            column_list.append(format_values(auto_consumption_rate[:, index_prod]))
+        auto_consumption = aggregate.auto_consumption.sum(axis=2)
+        auto_production_rate = np.round(aggregate.get_auto_production_rate(), 2)
+        for index_cons in range(aggregate.consumption.shape[1]):
+            column_list.append(format_values(aggregate.consumption[:, index_cons]))
+            column_list.append(format_values(auto_consumption[:, index_cons]))
+            column_list.append(format_values(auto_production_rate[:, index_cons]))
+        self.writer_list[index_resolution].writerows(zip(*column_list))
+
+    def finish(self):
+        # Write values of last period of each resolution
+        for index_resolution, current in enumerate(self.current_list):
+            if current is not None:
+                self.write_aggregate(index_resolution, current)
+        for csvfile in self.csvfile_list:
+            csvfile.close()
+            print('Aggregate report generated')
+        return self.file_list
+
+
+# The following class writes one columnar file per producer, with the same values as csv files:
+#   Horodate, computed, production, then for each consumer (named by its PRM):
+#   consumption, key, auto_consumption, and auto_cons as in statistics files
+# Names of producer and consumers are stored in metadata of the file
+class ColumnarSink(Sink):
+
+    def __init__(self, folder, format=PARQUET):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is needed to write ' + format + ' files')
+        if format not in COLUMNAR_FORMAT_LIST:
+            raise ValueError('Unknown columnar format: ' + str(format))
+        self.folder = folder
+        self.format = format
+        self.file_list = []
+        self.schema_list = []
+        self.writer_list = []
+
+    def start(self, rep, prod_list, cons_list):
+        field_list = [pyarrow.field('Horodate', pyarrow.timestamp('s')),
+                      pyarrow.field('computed', pyarrow.bool_()),
+                      pyarrow.field('production', pyarrow.float64())]
+        for prm in rep.prm_list:
+            field_list += [pyarrow.field(str(prm) + '_consumption', pyarrow.float64()),
+                           pyarrow.field(str(prm) + '_key', pyarrow.float64()),
+                           pyarrow.field(str(prm) + '_auto_consumption', pyarrow.float64()),
+                           pyarrow.field(str(prm) + '_auto_cons', pyarrow.float64())]
+
+        for prod in prod_list:
+            metadata = {'producer': str(prod.name), 'prm': str(prod.prm),
+                        'consumers': ';'.join(str(cons.name) for cons in cons_list)}
+            schema = pyarrow.schema(field_list, metadata=metadata)
+            if self.format == PARQUET:
+                file = self.folder + str(prod.prm) + '.parquet'
+                writer = pyarrow.parquet.ParquetWriter(file, schema)
+            else:
+                file = self.folder + str(prod.prm) + '.arrow'
+                writer = pyarrow.ipc.new_file(file, schema)
+            self.file_list.append(file)
+            self.schema_list.append(schema)
+            self.writer_list.append(writer)
+
+    def write(self, chunk):
+        timestamps = pyarrow.array(chunk.timestamps.astype('datetime64[s]'))
+        computed = pyarrow.array(chunk.computed)
+        for index_prod, writer in enumerate(self.writer_list):
+            initial_production = chunk.initial_production[:, index_prod]
+            key = chunk.key[:, :, index_prod]
+            auto_cons = np.floor(initial_production[:, np.newaxis] * key) / 100
+
+            column_list = [timestamps, computed, pyarrow.array(initial_production)]
+            for index_cons in range(key.shape[1]):
+                column_list += [pyarrow.array(chunk.consumption[:, index_cons]),
+                                pyarrow.array(key[:, index_cons]),
+                                pyarrow.array(chunk.auto_consumption[:, index_cons, index_prod]),
+                                pyarrow.array(auto_cons[:, index_cons])]
+            writer.write_batch(pyarrow.record_batch(column_list, schema=self.schema_list[index_prod]))
+
+    def finish(self):
+        for writer in self.writer_list:
+            writer.close()
+            print('Columnar file written')
+        return self.file_list
+
+
+# The following class computes global indicators of the repartition
+# Indicators are computed for the first producer, as in Repartition.get_*_rate
+class IndicatorSink(Sink):
+
+    def start(self, rep, prod_list, cons_list):
+        self.rep = rep
+        self.cons_list = cons_list
+        self.auto_consumption_producer = 0.0
+        self.auto_consumption = 0.0
+        self.production = 0.0
+
+    def write(self, chunk):
+        self.auto_consumption_producer = Engine.sequential_total(chunk.auto_consumption[:, :, 0],
+                                                                 self.auto_consumption_producer)
+        self.auto_consumption = Engine.sequential_total(chunk.auto_consumption, self.auto_consumption)
+        self.production = Engine.sequential_total(chunk.initial_production[:, 0], self.production)
+
+    def finish(self):
+        total_consumption = self.rep.get_total_consumption(self.cons_list)
+        return {
+            'auto_consumption_rate': Engine.get_rate(self.auto_consumption_producer, self.production),
+            'auto_production_rate_global': Engine.get_rate(self.auto_consumption, total_consumption),
+            'coverage_rate': Engine.get_rate(self.production, total_consumption)
+        }
+
+
+# This function reads results of the repartition once and gives them to each sink
+# It returns what has been produced by each sink
+def export(rep, prod_list, cons_list, sink_list, chunk_size=CHUNK_SIZE):
+    for sink in sink_list:
+        sink.start(rep, prod_list, cons_list)
+
+    for start in range(0, len(rep.timestamps), chunk_size):
+        chunk = Chunk(rep, start, min(start + chunk_size, len(rep.timestamps)))
+        for sink in sink_list:
+            sink.write(chunk)
+
+    return [sink.finish() for sink in sink_list]
@@ -7,15 +7,18 @@ from math import sqrt
 
 import datetime as dt
 
+import Curve
+
 def generate_graph(file,
                   sep,
                   group = False,
-                  resolution = 'hour'): # Resolution can be 'hour', 'day' or 'month'
+                  resolution = 'hour', # Resolution can be 'hour', 'day' or 'month'
+                  year = Curve.DEFAULT_YEAR): # Year of timestamps without year
     df = pd.read_csv(file, sep=sep)
 
-    # Set Horodate column to current year
+    # Set Horodate column to given year when timestamps have no year
     if '.' in  df['Horodate'].iloc[0]:
-        df['Horodate'] = pd.to_datetime('2025.' + df['Horodate'], format='%Y.%d.%m. %H:%M')
+        df['Horodate'] = pd.to_datetime(str(year) + '.' + df['Horodate'], format='%Y.%d.%m. %H:%M')
     elif '/' in  df['Horodate'].iloc[0]:
         df['Horodate'] = pd.to_datetime(df['Horodate'], format='%d/%m/%Y %H:%M')
 
@@ -90,7 +93,7 @@ def generate_graph(file,
 
     if resolution == 'jour':
         fig.update_xaxes(
-            range=['2025-01-01', '2025-12-31'],
+            range=[piv['date'].min(), piv['date'].max()],
             dtick='M1',  # Un trait par mois
             tickformat='%d %B',  # Format d'affichage des dates
             minor=dict(
@@ -102,7 +105,7 @@ def generate_graph(file,
         )
     else:
         fig.update_xaxes(
-            range=['2025-01-01', '2025-12-31'],
+            range=[piv['date'].min(), piv['date'].max()],
             dtick='M1',  # Un trait par mois
             tickformat='%B'  # Format d'affichage des dates
         )
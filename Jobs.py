@@ -0,0 +1,143 @@
+# This module is to define jobs running long computations in background
+# A job is submitted to a pool of worker threads and gets an id.
+# Its status, progress and result can then be read at any time with this id.
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Status of a job
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Default number of jobs running at the same time
+MAX_WORKERS = 2
+
+# Number of finished jobs kept with their result
+MAX_FINISHED_JOBS = 20
+
+# Number of finished jobs keeping their context (a whole repartition) in memory, the most recent ones
+MAX_CONTEXT_JOBS = 1
+
+
+class Job:
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = PENDING
+        # Description of the current step of the job
+        self.step = ''
+        # Number of slots processed and total number of slots to process
+        self.slots_processed = 0
+        self.slots_total = 0
+        # Value returned by the job, or error message if it failed
+        self.result = None
+        self.error = None
+        # Objects kept in memory with the result, to be reused by later requests
+        self.context = None
+        # Report of cProfile when the job is profiled
+        self.profile = None
+        self.date_created = time.time()
+        self.date_finished = None
+
+    # This function records progress of the job, it is given as callback to engines
+    def set_progress(self, slots_processed, slots_total):
+        self.slots_processed = slots_processed
+        self.slots_total = slots_total
+
+    # This function returns true if the job is not running anymore
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    # This function returns the status of the job as a dictionary
+    def to_dict(self):
+        progress = 100 * self.slots_processed / self.slots_total if self.slots_total else 0
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'step': self.step,
+            'slots_processed': self.slots_processed,
+            'slots_total': self.slots_total,
+            'progress': round(progress, 1),
+            'error': self.error,
+        }
+
+
+class JobQueue:
+
+    def __init__(self, max_workers=MAX_WORKERS, max_finished_jobs=MAX_FINISHED_JOBS, max_context_jobs=MAX_CONTEXT_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.max_finished_jobs = max_finished_jobs
+        self.max_context_jobs = max_context_jobs
+        # Jobs by id, in order of submission
+        self.job_dict = OrderedDict()
+        self.lock = threading.Lock()
+
+    # This function submits a job: function is called with the job, then the given arguments
+    # It returns the job immediately
+    def submit(self, function, *args, **kwargs):
+        job = Job(uuid.uuid4().hex)
+        with self.lock:
+            self.job_dict[job.id] = job
+            self.remove_old_jobs()
+        self.executor.submit(self.run, job, function, args, kwargs)
+        return job
+
+    # This function adds a job which is already done, for a result available without computation
+    def add_done(self, result):
+        job = Job(uuid.uuid4().hex)
+        job.result = result
+        job.status = DONE
+        job.date_finished = time.time()
+        with self.lock:
+            self.job_dict[job.id] = job
+            self.remove_old_jobs()
+        return job
+
+    # This function runs a job in a worker thread
+    def run(self, job, function, args, kwargs):
+        job.status = RUNNING
+        try:
+            job.result = function(job, *args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = FAILED
+        job.date_finished = time.time()
+        with self.lock:
+            self.release_old_contexts()
+
+    # This function returns a job from its id, or None if it does not exist
+    def get(self, job_id):
+        with self.lock:
+            return self.job_dict.get(job_id)
+
+    # This function returns the last job finished successfully, or None
+    # If accept is given, only jobs for which accept(job) is true are returned
+    def get_last_done(self, accept=None):
+        with self.lock:
+            done_list = [job for job in self.job_dict.values()
+                         if job.status == DONE and (accept is None or accept(job))]
+        if not done_list:
+            return None
+        return max(done_list, key=lambda job: job.date_finished)
+
+    # This function forgets the oldest finished jobs
+    # Lock must be held by the caller
+    def remove_old_jobs(self):
+        finished_list = [job for job in self.job_dict.values() if job.is_finished()]
+        for job in finished_list[:max(0, len(finished_list) - self.max_finished_jobs)]:
+            del self.job_dict[job.id]
+
+    # This function releases contexts of finished jobs, except the most recent ones
+    # Lock must be held by the caller
+    def release_old_contexts(self):
+        context_list = sorted((job for job in self.job_dict.values() if job.is_finished() and job.context is not None),
+                              key=lambda job: job.date_finished)
+        for job in context_list[:max(0, len(context_list) - self.max_context_jobs)]:
+            job.context = None
@@ -0,0 +1,170 @@
+# This module is to measure where time goes when computing repartitions
+# Metrics are kept in memory by the process and read in Prometheus text format (see render):
+#   - counters: values which only increase (slots processed, bytes written, ...)
+#   - gauges: last value measured (deepest priority level of the last computation, ...)
+#   - summaries: count and sum of observed values (time of each stage, ...)
+#   - histograms: number of observed values below each bucket (redistribution rounds per slot, ...)
+# Each stage timed and each counter increased is also written as a structured log (one JSON per line).
+# A single request can also be profiled with cProfile (see profile_call).
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger('repartition')
+
+# Buckets of histograms of redistribution rounds per slot
+ROUND_BUCKET_LIST = [1, 2, 3, 5, 10, 20, 50, 100, 1000]
+
+# Number of functions listed in profiling reports
+PROFILE_LIMIT = 60
+
+
+# The following class contains metrics of the process
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # For each metric: type and help text
+        self.description_dict = {}
+        # For each metric: value of each set of labels
+        #   counter and gauge: value, summary: (count, sum), histogram: (count of each bucket, count, sum)
+        self.value_dict = {}
+        # Buckets of each histogram
+        self.bucket_dict = {}
+
+    # This function declares a metric
+    def describe(self, name, type, help):
+        with self.lock:
+            self.description_dict[name] = (type, help)
+            self.value_dict.setdefault(name, {})
+
+    # This function increases a counter
+    def increment(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.value_dict.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+        log('counter', metric=name, value=value, **labels)
+
+    # This function sets the value of a gauge
+    def set_gauge(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.value_dict.setdefault(name, {})[key] = value
+        log('gauge', metric=name, value=value, **labels)
+
+    # This function adds a value to a summary
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.value_dict.setdefault(name, {})
+            count, total = values.get(key, (0, 0.0))
+            values[key] = (count + 1, total + value)
+
+    # This function adds values to a histogram with given buckets
+    def observe_histogram(self, name, values, bucket_list, **labels):
+        values = np.asarray(values)
+        key = tuple(sorted(labels.items()))
+        bucket_count = [int(np.count_nonzero(values <= bucket)) for bucket in bucket_list]
+        with self.lock:
+            self.bucket_dict[name] = bucket_list
+            histogram = self.value_dict.setdefault(name, {})
+            previous_count, count, total = histogram.get(key, ([0] * len(bucket_list), 0, 0.0))
+            histogram[key] = ([previous + new for previous, new in zip(previous_count, bucket_count)],
+                              count + len(values), total + float(values.sum()))
+
+    # This function returns all metrics in Prometheus text format
+    def render(self):
+        line_list = []
+        with self.lock:
+            for name, values in self.value_dict.items():
+                type, help = self.description_dict.get(name, ('untyped', ''))
+                line_list.append('# HELP ' + name + ' ' + help)
+                line_list.append('# TYPE ' + name + ' ' + type)
+                for key, value in values.items():
+                    if type == 'summary':
+                        count, total = value
+                        line_list.append(name + '_count' + format_labels(key) + ' ' + format_number(count))
+                        line_list.append(name + '_sum' + format_labels(key) + ' ' + format_number(total))
+                    elif type == 'histogram':
+                        bucket_count, count, total = value
+                        for bucket, bucket_value in zip(self.bucket_dict[name], bucket_count):
+                            line_list.append(name + '_bucket' + format_labels(key + (('le', str(bucket)),))
+                                             + ' ' + format_number(bucket_value))
+                        line_list.append(name + '_bucket' + format_labels(key + (('le', '+Inf'),)) + ' ' + format_number(count))
+                        line_list.append(name + '_count' + format_labels(key) + ' ' + format_number(count))
+                        line_list.append(name + '_sum' + format_labels(key) + ' ' + format_number(total))
+                    else:
+                        line_list.append(name + format_labels(key) + ' ' + format_number(value))
+        return '\n'.join(line_list) + '\n'
+
+
+# This function returns labels in Prometheus text format
+def format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for name, value in key) + '}'
+
+
+# This function returns a number in Prometheus text format
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# This function writes a structured log, at INFO level unless another level is given
+def log(event, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(dict(event=event, **fields), default=str))
+
+
+# Metrics of the process
+registry = Registry()
+registry.describe('repartition_stage_seconds', 'summary', 'Time spent in each stage of a request')
+registry.describe('repartition_slots_processed_total', 'counter', 'Number of slots whose keys have been computed')
+registry.describe('repartition_dynamic_rounds', 'histogram', 'Redistribution rounds of each slot computed with DYNAMIC')
+registry.describe('repartition_dynamic_depth', 'gauge', 'Deepest priority level reached by the last DYNAMIC computation')
+registry.describe('repartition_bytes_written_total', 'counter', 'Number of bytes of export files written')
+registry.describe('repartition_requests_total', 'counter', 'Number of compute requests')
+
+
+# This context manager measures time of a stage of a request
+@contextmanager
+def timer(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe('repartition_stage_seconds', seconds, stage=stage, **labels)
+        log('stage', stage=stage, seconds=round(seconds, 6), **labels)
+
+
+# This function records statistics of the engines (see Repartition.engine_stats)
+def record_engine_stats(engine_stats, **labels):
+    registry.increment('repartition_slots_processed_total', engine_stats['slots'], **labels)
+    if engine_stats['rounds'] is not None:
+        registry.observe_histogram('repartition_dynamic_rounds', engine_stats['rounds'], ROUND_BUCKET_LIST, **labels)
+        registry.set_gauge('repartition_dynamic_depth', engine_stats['max_depth'], **labels)
+
+
+# This function calls function with cProfile enabled
+# It returns the result of the function and the report of the profile, sorted by cumulative time
+def profile_call(function, *args, **kwargs):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LIMIT)
+        log('profile', function=getattr(function, '__name__', str(function)))
+    return result, stream.getvalue()
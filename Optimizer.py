@@ -0,0 +1,146 @@
+# This module is to search priority and ratio of consumers maximizing auto-consumption
+# with Strategy.DYNAMIC
+# The search is a coordinate descent: at each step, every move of one setting is evaluated
+#   - ratio of one consumer for one producer increased or decreased by the current step
+#   - priority of one consumer for one producer moved one level up or down
+# then the best move is applied. When no move improves the score, the step of ratios is
+# reduced, until the smallest step. All moves of a step are evaluated as one batch of scenarios
+# (see Scenario.Evaluator), on several processes.
+# Moves are taken in turn from each consumer, in a random order, so that all consumers are tried
+# when the number of evaluations left is lower than the number of moves.
+#
+# Constraints:
+#   - ratios of consumers having the same priority for a producer do not exceed 100 in total,
+#     so that keys never give more than the production. Moves breaking this constraint are not
+#     generated, a starting setting exceeding it is penalized until it is met
+#   - min_ratio: minimum ratio of each consumer for each producer
+#   - min_share: minimum share (percent) of total auto-consumption received by each consumer
+import itertools
+
+import numpy as np
+
+import Repartition
+import Scenario
+
+# Steps of ratios, from the first one to the smallest one
+RATIO_STEP_LIST = [20, 10, 5, 1]
+
+# Maximum number of scenarios evaluated by default
+MAX_EVALUATIONS = 500
+
+# Seed of the random order of consumers, so that the same search gives the same result
+SEED = 0
+
+
+# This function returns a value given for all consumers or for each consumer as an array (consumers)
+def get_consumer_values(value, nb_cons):
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (nb_cons,))
+
+
+# This function returns how much sums of ratios of each priority of each producer exceed 100
+def get_ratio_excess(priority, ratio):
+    excess = 0.0
+    for level in np.unique(priority).tolist():
+        excess += float(np.maximum(np.where(priority == level, ratio, 0.0).sum(axis=0) - 100, 0).sum())
+    return excess
+
+
+# This function returns how much shares of consumers are below their minimum share (percent)
+# It is 0 when the setting meets all constraints
+def get_violation(indicators, min_share):
+    total = indicators['auto_consumption']
+    share = np.asarray(indicators['auto_consumption_list']) * 100 / total if total > 0 else 0.0
+    return float(np.maximum(min_share - share, 0).sum())
+
+
+# This function returns the score of a setting, the higher the better:
+# settings closer to the constraints first, then settings with more auto-consumption
+def get_score(priority, ratio, indicators, min_share):
+    return -get_ratio_excess(priority, ratio), -get_violation(indicators, min_share), indicators['auto_consumption']
+
+
+# This function returns the sum of ratios of consumers having the given priority for a producer
+def get_level_ratio(priority, ratio, index_prod, level):
+    return float(ratio[priority[:, index_prod] == level, index_prod].sum())
+
+
+# This function returns all moves from a setting as (priority, ratio), taken in turn from each consumer
+# Consumers are taken in the order given by rng. Priorities of a consumer stay between 0 and
+# the number of consumers - 1. Ratios of a priority of a producer do not go above 100 in total.
+def get_move_list(priority, ratio, step, min_ratio, rng):
+    nb_cons, nb_prod = priority.shape
+    cons_move_list = []
+    for index_cons in rng.permutation(nb_cons).tolist():
+        move_list = []
+        for index_prod in range(nb_prod):
+            level = priority[index_cons, index_prod]
+            current = ratio[index_cons, index_prod]
+            level_ratio = get_level_ratio(priority, ratio, index_prod, level)
+            for new_ratio in (current + step, current - step):
+                new_ratio = min(100.0, max(min_ratio[index_cons], new_ratio))
+                if new_ratio > current:
+                    new_ratio = min(new_ratio, max(current, 100 - (level_ratio - current)))
+                if new_ratio != current:
+                    new_ratio_matrix = ratio.copy()
+                    new_ratio_matrix[index_cons, index_prod] = new_ratio
+                    move_list.append((priority, new_ratio_matrix))
+            for new_level in (level - 1, level + 1):
+                if 0 <= new_level < nb_cons and get_level_ratio(priority, ratio, index_prod, new_level) + current <= 100:
+                    new_priority_matrix = priority.copy()
+                    new_priority_matrix[index_cons, index_prod] = new_level
+                    move_list.append((new_priority_matrix, ratio))
+        cons_move_list.append(move_list)
+
+    # Take one move of each consumer in turn
+    return [move for move_tuple in itertools.zip_longest(*cons_move_list) for move in move_tuple if move is not None]
+
+
+# This function returns a scenario of Strategy.DYNAMIC for a setting
+def get_scenario(priority, ratio, name=''):
+    return Scenario.Scenario(Repartition.Strategy.DYNAMIC, None, priority.tolist(), ratio.tolist(), name)
+
+
+# This function searches the setting maximizing auto-consumption, starting from the one of consumers
+# It returns the best setting found with its indicators, and the number of scenarios evaluated
+# progress is called after each step with the number of scenarios evaluated and the maximum number
+def optimize(prod_list, cons_list, min_ratio=0, min_share=0, max_evaluations=MAX_EVALUATIONS,
+             ratio_step_list=RATIO_STEP_LIST, workers=1, progress=None, seed=SEED):
+    context = Scenario.Context(prod_list, cons_list)
+    nb_cons = len(cons_list)
+    min_ratio = get_consumer_values(min_ratio, nb_cons)
+    min_share = get_consumer_values(min_share, nb_cons)
+
+    priority = context.priority.copy()
+    ratio = np.maximum(context.ratio, min_ratio[:, np.newaxis])
+    rng = np.random.default_rng(seed)
+
+    with Scenario.Evaluator(context, workers) as evaluator:
+        best, = evaluator.evaluate([get_scenario(priority, ratio)])
+        best_score = get_score(priority, ratio, best, min_share)
+        nb_evaluation = 1
+
+        for step in ratio_step_list:
+            while nb_evaluation < max_evaluations:
+                move_list = get_move_list(priority, ratio, step, min_ratio, rng)[:max_evaluations - nb_evaluation]
+                indicator_list = evaluator.evaluate([get_scenario(move_priority, move_ratio)
+                                                     for move_priority, move_ratio in move_list])
+                nb_evaluation += len(move_list)
+                if progress is not None:
+                    progress(nb_evaluation, max_evaluations)
+
+                best_move = None
+                for move, indicators in zip(move_list, indicator_list):
+                    score = get_score(move[0], move[1], indicators, min_share)
+                    if score > best_score:
+                        best_move, best, best_score = move, indicators, score
+                if best_move is None:
+                    break
+                priority, ratio = best_move
+
+    return {
+        'priority_list': priority.tolist(),
+        'ratio_list': ratio.tolist(),
+        'feasible': best_score[0] == 0 and best_score[1] == 0,
+        'indicators': best,
+        'evaluations': nb_evaluation
+    }
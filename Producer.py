@@ -1,7 +1,9 @@
 # This module is to define Producer class
-import csv
 from calendar import prmonth
 
+import Curve
+import CurveRepository
+
 class Producer:
 
     # Define class point to contain specific value for each point
@@ -17,34 +19,49 @@ class Producer:
         self.name = name
         # Point Reference Mesure: uniquely identify the producer
         self.prm = prm
-        # List of points for each slot of 15 min
-        self.point_list = []
+        # Production curve: timestamp and production for each slot of 15 min
+        self.curve = Curve.Curve.empty()
         if file is not None:
             self.read_production(file)
 
+    # Production for each slot of 15 min
+    @property
+    def production(self):
+        return self.curve.values
+
+    # List of points for each slot of 15 min
+    # Points are built from the curve when accessed, they are kept for compatibility
+    @property
+    def point_list(self):
+        return Curve.PointList(self.curve, Producer.Point)
+
+    # Objects saved before curves were stored as arrays contain a list of points
+    def __setstate__(self, state):
+        if 'point_list' in state:
+            point_list = state.pop('point_list')
+            state['curve'] = Curve.Curve.from_points([point.slot for point in point_list],
+                                                     [point.prod for point in point_list])
+        self.__dict__.update(state)
+
     # This function reads a file to set production values
     def read_production(self, file):
-        with open(file, newline='') as csvfile:
-            next(csvfile) # Skip first line of the file which contains title
-            prod_file = csv.reader(csvfile,delimiter=';')
-            for row in prod_file:
-                self.point_list.append(Producer.Point(row[0], float(row[1].replace(',','.'))))
-                # print(row)
-            print('Producer file read!')
-
-    # This function reads a stream
-    # def read_stream(self, stream):
-    #     prod_file = csv.reader(stream,delimiter=';')
-    #     for row in prod_file:
-    #         try:
-    #             self.point_list.append(Producer.Point(row[0], float(row[1].replace(',','.'))))
-    #         except ValueError as e:
-    #             print('Erreur')
-    #         #print(row)
-    #     print('Stream read!')
+        self.curve = Curve.read_curve(file)
+        print('Producer file read!')
+
+    # This function opens a binary file of the curve repository to set production values
+    # Values are not copied, they are read from the memory-mapped file
+    def open_production(self, file):
+        self.curve = CurveRepository.open_curve(file)
+
+    # This function reads a stream (binary file object) to set production values
+    # The stream is parsed chunk by chunk, as it is read
+    def read_stream(self, stream):
+        self.curve = Curve.read_stream(stream, self.name)
+        print('Stream read!')
 
     # This function apply a factor to the initial production.
     # This is useful to get statistic with lower production
     def apply_factor(self, factor):
-        for point in self.point_list:
-            point.prod *= factor
\ No newline at end of file
+        self.curve.values = self.curve.values * factor
+        # Values are no longer the ones of the curve repository
+        self.curve.digest = None
\ No newline at end of file
@@ -0,0 +1,248 @@
+# This module is to check that engines computing keys give exactly the keys of the reference implementation
+# The reference is the object based implementation of Repartition, computing one Point at a time
+# (calculate_rep_key_dynamic_by_default and calculate_rep_key_dynamic). Keys written in files depend on
+# the floor rounding of auto_consumption, so engines must give the same floats, not only close ones.
+#
+# Both implementations are run side by side on:
+#   - the sample curves of Courbes/, with several settings of priority and ratio
+#   - random communities, with null production or consumption, several priority levels and producers
+# Every computed slot is compared, for each engine:
+#   - VECTORIZED: Engine.compute_dynamic_by_default and Engine.compute_dynamic, on one process
+#   - PARALLEL: Engine.compute_parallel, slots split in small chunks between processes
+#   - SPARSE: Repartition.compute_rep, which only stores slots with consumption, keys read with get_key
+# Slots where the reference fails (e.g. division by zero when ratios of all active consumers are 0)
+# are counted apart, as engines have no result to match there.
+#
+# Engines must pass this check before being used or changed: the exit code is 1 when a key or
+# an auto_consumption differs from the reference, 0 otherwise.
+#
+# Usage: python Regression.py [--seeds 50] [--workers 2] [--no-sample] [--output regression.json]
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import Consumer
+import Engine
+import Producer
+import Repartition
+
+# Engines compared to the reference
+VECTORIZED = 'vectorized'
+PARALLEL = 'parallel'
+SPARSE = 'sparse'
+ENGINE_LIST = [VECTORIZED, PARALLEL, SPARSE]
+
+# Strategies compared
+STRATEGY_LIST = [Repartition.Strategy.DYNAMIC_BY_DEFAULT, Repartition.Strategy.DYNAMIC]
+
+# Folder of sample curves
+SAMPLE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Courbes', '')
+
+# Number of slots of chunks computed by each process with PARALLEL, small to test limits of chunks
+CHUNK_SIZE = 97
+
+# Number of mismatches reported for each check
+MAX_REPORTED = 10
+
+
+# This function computes keys of given slots with the reference implementation
+# key contains initial keys of each slot (slots x consumers x producers), as Repartition.get_initial_key
+# It returns keys, auto_consumption and true for slots where the reference failed
+def compute_reference(cons, prod, priority, key, strategy):
+    rep = Repartition.Repartition()
+    reference_key = np.zeros(key.shape)
+    auto_consumption = np.zeros(key.shape)
+    failed = np.zeros(cons.shape[0], dtype=bool)
+    priority_list = priority.tolist()
+    for index_slot, (cons_slot, prod_slot, key_slot) in enumerate(zip(cons.tolist(), prod.tolist(), key.tolist())):
+        point = Repartition.Repartition.Point(index_slot)
+        for production in prod_slot:
+            point.prod_list.append(Repartition.Repartition.Point.ProdRepart(production))
+        for consumption, cons_priority, cons_key in zip(cons_slot, priority_list, key_slot):
+            point.cons_list.append(Repartition.Repartition.Point.ConsRepart(consumption, cons_priority, cons_key))
+        try:
+            if strategy == Repartition.Strategy.DYNAMIC_BY_DEFAULT:
+                rep.calculate_rep_key_dynamic_by_default(point)
+            else:
+                rep.calculate_rep_key_dynamic(0, point)
+        except (ZeroDivisionError, RecursionError):
+            failed[index_slot] = True
+            continue
+        for index_cons, cons_point in enumerate(point.cons_list):
+            for index_prod, param in enumerate(cons_point.param_list):
+                reference_key[index_slot, index_cons, index_prod] = param.key
+                auto_consumption[index_slot, index_cons, index_prod] = param.auto_consumption
+    return reference_key, auto_consumption, failed
+
+
+# This function computes keys of given slots with an engine
+def compute_engine(engine, cons, prod, priority, ratio, key, strategy, workers=2):
+    if engine == SPARSE:
+        rep = Repartition.Repartition()
+        rep.consumption = cons
+        rep.initial_production = prod
+        rep.compute_rep(strategy, priority, ratio)
+        return rep.get_key(), rep.get_auto_consumption()
+    if strategy == Repartition.Strategy.DYNAMIC_BY_DEFAULT:
+        priority = None
+    if engine == PARALLEL:
+        return Engine.compute_parallel(cons, prod, priority, key, workers=workers, chunk_size=CHUNK_SIZE)
+    if priority is None:
+        return Engine.compute_dynamic_by_default(cons, prod)
+    return Engine.compute_dynamic(cons, prod, priority, key)
+
+
+# This function returns true for values which are not exactly the same
+# 0.0 and -0.0 are different, as they are not written the same way
+def get_difference(reference, values):
+    return (reference != values) | (np.signbit(reference) != np.signbit(values))
+
+
+# This function compares keys of all engines to the reference on a community, for one strategy
+# cons is consumption (slots x consumers), prod is production (slots x producers),
+# priority and ratio are given for each consumer and each producer (consumers x producers)
+# It returns one result per engine with the list of mismatches
+def check(name, cons, prod, priority, ratio, strategy, engine_list=ENGINE_LIST, workers=2):
+    rep = Repartition.Repartition()
+    rep.consumption = np.asarray(cons, dtype=np.float64)
+    rep.initial_production = np.asarray(prod, dtype=np.float64)
+    rep.ratio = np.asarray(ratio, dtype=np.float64)
+    priority = np.asarray(priority, dtype=np.int64)
+
+    # Keys are only computed when production of the first producer is not null, as in Repartition.compute_rep
+    slot_index = np.flatnonzero(rep.initial_production[:, 0] != 0)
+    cons = rep.consumption[slot_index]
+    prod = rep.initial_production[slot_index]
+    initial_key = rep.get_initial_key()[slot_index]
+    reference_key, reference_auto_consumption, failed = compute_reference(cons, prod, priority, initial_key, strategy)
+
+    result_list = []
+    for engine in engine_list:
+        key, auto_consumption = compute_engine(engine, cons, prod, priority, rep.ratio, initial_key, strategy, workers)
+        difference = get_difference(reference_key, key) | get_difference(reference_auto_consumption, auto_consumption)
+        difference[failed] = False
+        mismatch_list = []
+        for index_slot, index_cons, index_prod in np.argwhere(difference)[:MAX_REPORTED].tolist():
+            mismatch_list.append({
+                'slot': int(slot_index[index_slot]),
+                'consumer': index_cons,
+                'producer': index_prod,
+                'reference_key': reference_key[index_slot, index_cons, index_prod],
+                'key': key[index_slot, index_cons, index_prod],
+                'reference_auto_consumption': reference_auto_consumption[index_slot, index_cons, index_prod],
+                'auto_consumption': auto_consumption[index_slot, index_cons, index_prod]
+            })
+        result_list.append({
+            'community': name,
+            'strategy': strategy,
+            'engine': engine,
+            'slots': len(slot_index),
+            'reference_failed': int(failed.sum()),
+            'mismatched_slots': int(difference.any(axis=(1, 2)).sum()),
+            'mismatch_list': mismatch_list
+        })
+    return result_list
+
+
+# This function generates a random community
+# It returns consumption, production, priority and ratio
+def generate_random_community(seed, nb_slot=300):
+    rng = np.random.default_rng(seed)
+    nb_cons = 1 + seed % 7
+    nb_prod = 1 + seed % 3
+    max_priority = seed % 4
+
+    # Production is null at night, and sometimes only for some producers
+    prod = np.maximum(0, rng.normal(500, 400, (nb_slot, nb_prod))).round(2)
+    prod[rng.random(nb_slot) < 0.3] = 0
+    prod[rng.random((nb_slot, nb_prod)) < 0.05] = 0
+    cons = np.maximum(0, rng.normal(200, 150, (nb_slot, nb_cons))).round(1)
+    cons[rng.random((nb_slot, nb_cons)) < 0.2] = 0
+
+    priority = rng.integers(0, max_priority + 1, (nb_cons, nb_prod))
+    ratio = rng.integers(0, 101, (nb_cons, nb_prod)).astype(np.float64)
+    return cons, prod, priority, ratio
+
+
+# This function loads the sample curves: producers Simu_Prod_*, other files are consumers
+# A second producer with half of the production is added to check communities with several producers
+def load_sample_community(folder=SAMPLE_FOLDER):
+    file_list = sorted(file for file in os.listdir(folder) if file.endswith('.csv'))
+    prod_list = [Producer.Producer(file[:-4], file[:-4], folder + file) for file in file_list if file.startswith('Simu_Prod_')]
+    second = Producer.Producer(prod_list[0].name + '_2', prod_list[0].prm + '_2', folder + prod_list[0].name + '.csv')
+    second.apply_factor(0.5)
+    prod_list.append(second)
+    # Priority and ratio are given by each setting, they are not used to load curves
+    cons_list = [Consumer.Consumer(file[:-4], file[:-4], [0] * len(prod_list), [0] * len(prod_list), folder + file)
+                 for file in file_list if not file.startswith('Simu_Prod_')]
+
+    rep = Repartition.Repartition()
+    rep.build_rep(prod_list, cons_list, Repartition.Strategy.DYNAMIC_BY_DEFAULT)
+    return rep.consumption, rep.initial_production
+
+
+# This function returns settings of priority and ratio used on sample curves
+def get_sample_setting_list(nb_cons, nb_prod):
+    index_cons = np.arange(nb_cons)[:, np.newaxis]
+    index_prod = np.arange(nb_prod)[np.newaxis, :]
+    return [
+        ('same_priority', np.zeros((nb_cons, nb_prod), dtype=np.int64), np.full((nb_cons, nb_prod), 100 // nb_cons)),
+        ('two_priorities', np.broadcast_to(index_cons % 2, (nb_cons, nb_prod)), 20 + 10 * index_cons + 0 * index_prod),
+        ('priority_by_producer', (index_cons + index_prod) % nb_cons, np.full((nb_cons, nb_prod), 50))
+    ]
+
+
+# This function runs all checks and returns their results
+# progress is called after each check with its results
+def run(nb_seed=50, sample=True, engine_list=ENGINE_LIST, workers=2, progress=None):
+    community_list = []
+    if sample:
+        cons, prod = load_sample_community()
+        for name, priority, ratio in get_sample_setting_list(cons.shape[1], prod.shape[1]):
+            community_list.append(('sample_' + name, cons, prod, priority, ratio))
+    for seed in range(nb_seed):
+        community_list.append(('random_' + str(seed),) + generate_random_community(seed))
+
+    result_list = []
+    for name, cons, prod, priority, ratio in community_list:
+        for strategy in STRATEGY_LIST:
+            check_result_list = check(name, cons, prod, priority, ratio, strategy, engine_list, workers)
+            result_list.extend(check_result_list)
+            if progress is not None:
+                progress(check_result_list)
+    return result_list
+
+
+# This function prints results of a check
+def print_result_list(result_list):
+    for result in result_list:
+        print(result['community'] + ' (strategy ' + str(result['strategy']) + ', ' + result['engine'] + '): '
+              + str(result['slots']) + ' slots, ' + str(result['mismatched_slots']) + ' mismatched, '
+              + str(result['reference_failed']) + ' failed in reference')
+        for mismatch in result['mismatch_list']:
+            print('    slot ' + str(mismatch['slot']) + ', consumer ' + str(mismatch['consumer'])
+                  + ', producer ' + str(mismatch['producer']) + ': key ' + repr(mismatch['reference_key'])
+                  + ' -> ' + repr(mismatch['key']) + ', auto_consumption ' + repr(mismatch['reference_auto_consumption'])
+                  + ' -> ' + repr(mismatch['auto_consumption']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that engines give exactly the keys of the reference implementation')
+    parser.add_argument('--seeds', type=int, default=50, help='Number of random communities')
+    parser.add_argument('--workers', type=int, default=2, help='Number of processes of the parallel engine')
+    parser.add_argument('--engines', nargs='+', choices=ENGINE_LIST, default=ENGINE_LIST)
+    parser.add_argument('--no-sample', action='store_true', help='Do not check sample curves of Courbes/')
+    parser.add_argument('--output', help='JSON file of results')
+    args = parser.parse_args()
+
+    result_list = run(args.seeds, not args.no_sample, args.engines, args.workers, progress=print_result_list)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result_list, file, indent=2)
+
+    nb_mismatch = sum(1 for result in result_list if result['mismatched_slots'] > 0)
+    print(str(len(result_list)) + ' checks, ' + str(nb_mismatch) + ' with mismatches')
+    sys.exit(1 if nb_mismatch else 0)
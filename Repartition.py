@@ -1,9 +1,13 @@
 # This module is to define Repartition class
-import csv
 import logging
 import math
 
-from datetime import datetime
+import numpy as np
+
+import Alignment
+import Curve
+import Engine
+import Export
 
 # logging.basicConfig(level=logging.DEBUG)
 # logger = logging.getLogger(__name__)
@@ -42,6 +46,9 @@ class State:
 class Repartition:
 
     # Class to contain specific information for each point
+    # Points are used by the object based implementation computing keys for one slot
+    # (calculate_rep_key_dynamic_by_default and calculate_rep_key_dynamic).
+    # This implementation is the reference for the vectorized engines.
     class Point:
 
         # Class containing producer information to compute repartition keys
@@ -79,26 +86,40 @@ class Repartition:
     def __init__(self, *prm_list):
         # List of PRM
         self.prm_list = []
-        # List of points for each slot of 15 min
-        self.point_list = []
+        # Timestamp of each slot of 15 min (datetime64)
+        self.timestamps = np.zeros(0, dtype='datetime64[m]')
+        # Format used to write timestamps
+        self.date_format = Curve.DAY_MONTH_YEAR
+        # Consumption of each consumer (slots x consumers)
+        self.consumption = np.zeros((0, 0))
+        # Production of each producer (slots x producers)
+        self.initial_production = np.zeros((0, 0))
+        # Production not used by consumers (slots x producers)
+        self.production = np.zeros((0, 0))
+        # True for slots where keys have been computed (production is not null)
+        # Other slots keep initial ratio as key
+        self.computed = np.zeros(0, dtype=bool)
+        # Keys are only stored for computed slots where at least one consumer consumes:
+        # keys and auto_consumption of other slots are known without computation (see get_key)
+        # Index of stored slots, then repartition key and auto_consumption of each consumer for each producer
+        # (stored slots x consumers x producers)
+        self.slot_index = np.zeros(0, dtype=np.int64)
+        self.slot_key = np.zeros((0, 0, 0))
+        self.slot_auto_consumption = np.zeros((0, 0, 0))
+        # Strategy, priority and ratio of each consumer for each producer (consumers x producers)
+        # used to compute keys
+        self.type = None
+        self.priority = np.zeros((0, 0), dtype=np.int64)
+        self.ratio = np.zeros((0, 0))
+        # Statistics of the last computation of keys: number of slots computed, and for Strategy.DYNAMIC,
+        # number of distribution rounds of each slot and deepest priority computed (None otherwise)
+        self.engine_stats = {'slots': 0, 'rounds': None, 'max_depth': None}
 
     # This function adds PRM of consumers
     def add_prm(self, cons_list):
         for cons in cons_list:
             self.prm_list.append(cons.prm)
 
-    # This function adds point with slot information
-    def add_point(self, slot):
-        self.point_list.append(Repartition.Point(slot))
-
-    # This function adds production value to the point list
-    def add_point_prod(self, index, prod):
-        self.point_list[index].prod_list.append(Repartition.Point.ProdRepart(prod))
-
-    # This function adds consumption value to the point list
-    def add_point_cons(self, index, cons, priority, ratio):
-        self.point_list[index].cons_list.append(Repartition.Point.ConsRepart(cons, priority, ratio))
-
     # This function returns true if at least one consumer is active
     def are_consumers_active(self, point):
         active = False
@@ -272,111 +293,168 @@ class Repartition:
                 param.key = math.floor(param.auto_consumption * 1000 / point.prod_list[index_param].initial_production) / 10
 
     # Function to build repartition
-    def build_rep(self, prod_list, cons_list, type):
+    # progress is called with the number of slots computed and the total number of slots to compute
+    # workers is the number of processes computing keys, slots are split in chunks between them
+    def build_rep(self, prod_list, cons_list, type, progress=None, workers=1):
 
         # First get list of prm
         self.add_prm(cons_list)
 
-        # Build for each time slot the list of points with producer and consumers values:
-        #   [prod_slot1, cons1_slot1, cons2_slot1, ..., consN_slot1]
-        #   [prod_slot2, cons1_slot2, cons2_slot2, ..., consN_slot2]
+        # Build for each time slot the production and consumption values:
+        #   [prod1_slot1, ..., prodP_slot1]    [cons1_slot1, cons2_slot1, ..., consN_slot1]
+        #   [prod1_slot2, ..., prodP_slot2]    [cons1_slot2, cons2_slot2, ..., consN_slot2]
         #   ...
-        #   [prod_slotX, cons1_slotX, cons2_slotX, ..., consN_slotX]
+        #   [prod1_slotX, ..., prodP_slotX]    [cons1_slotX, cons2_slotX, ..., consN_slotX]
+        # Slots are the ones of the first producer, values of other curves are joined by timestamp
+        item_list = list(prod_list) + list(cons_list)
+        self.timestamps, values, missing = Alignment.align([item.curve for item in item_list])
+        self.date_format = prod_list[0].curve.date_format
+        # Slots without value are 0, curves covering another period are rejected
+        Alignment.check_missing([item.name for item in item_list], missing, len(self.timestamps))
+        self.initial_production = values[:, :len(prod_list)]
+        self.consumption = values[:, len(prod_list):]
+
+        self.compute_rep(type, self.get_priority(cons_list), self.get_ratio(cons_list), progress, workers)
+
+    # This function computes keys of all slots once production and consumption are set
+    # priority and ratio are given for each consumer and each producer (consumers x producers)
+    def compute_rep(self, type, priority, ratio, progress=None, workers=1):
+
+        self.type = type
+        self.priority = priority
+        self.ratio = ratio
+
+        # Compute repartition keys only if production is not null
+        # Without consumption, keys and auto_consumption of all consumers are 0: such slots are not stored
+        self.computed = self.initial_production[:, 0] != 0
+        self.slot_index = np.flatnonzero(self.computed & (self.consumption != 0).any(axis=1))
+
         # Build list of keys using initial ratio
-        for i,prod_slot in enumerate(prod_list[0].point_list):
-            # First add slot
-            self.add_point(prod_slot.slot)
-
-            # Populate producer list
-            for producer in prod_list:
-                self.add_point_prod(i, producer.point_list[i].prod)
-
-            # Then iterate on each consumer to add its information
-            for cons in cons_list:
-                # In case production is 0, force consumer information to 0
-                # Otherwise add consumers information and calculate repartition keys
-                if producer.point_list[i].prod == 0:
-                    null_ratio_list = [0 for i in range(0, len(cons.ratio_list))]
-                    self.add_point_cons(i, cons.point_list[i].cons, cons.priority_list, null_ratio_list)
-                else:
-                    self.add_point_cons(i, cons.point_list[i].cons, cons.priority_list, cons.ratio_list)
-
-            # Compute repartition keys only if production is not null
-            if prod_slot.prod != 0:
-                if type == Strategy.DYNAMIC_BY_DEFAULT:
-                    self.calculate_rep_key_dynamic_by_default(self.point_list[i])
-                elif type == Strategy.DYNAMIC:
-                    self.calculate_rep_key_dynamic(0, self.point_list[i])
-                else:
-                    self.calculate_rep_key_dynamic(0, self.point_list[i])
+        self.slot_key = self.get_initial_key(self.slot_index)
+        self.slot_auto_consumption = np.zeros(self.slot_key.shape)
+        self.compute_slots(np.arange(len(self.slot_index)), progress, workers)
+
+    # This function updates repartition after priority or ratio of consumers changed
+    # Only slots whose keys depend on changed values are computed again:
+    #   - Strategy.DYNAMIC_BY_DEFAULT does not use priority and ratio, only initial keys change
+    #   - a ratio is only used when production of its producer and of the last producer are not null
+    #   - a priority is only used when production of its producer is not null, as long as
+    #     the set of priorities of the consumer is the same (this set decides if the consumer takes part
+    #     in each priority level, whatever the producer)
+    # Number of consumers and producers must be the same as in build_rep
+    # It returns the number of slots computed again
+    def update_rep(self, cons_list, progress=None, workers=1):
+        priority = self.get_priority(cons_list)
+        ratio = self.get_ratio(cons_list)
+        if priority.shape != self.priority.shape or ratio.shape != self.ratio.shape:
+            raise ValueError('Consumers or producers changed, repartition must be built again')
+
+        priority_changed = priority != self.priority
+        changed = priority_changed | (ratio != self.ratio)
+        level_changed = any(set(old_row) != set(new_row)
+                            for old_row, new_row in zip(self.priority.tolist(), priority.tolist()))
+        self.priority = priority
+        self.ratio = ratio
+
+        # Keys of slots not computed are the initial keys, they are read from ratio (see get_key)
+        if self.type == Strategy.DYNAMIC_BY_DEFAULT or not changed.any():
+            return 0
+
+        production = self.initial_production[self.slot_index]
+        if level_changed:
+            update = np.ones(len(self.slot_index), dtype=bool)
+        else:
+            update = (production[:, changed.any(axis=0)] != 0).any(axis=1)
+            if not priority_changed.any():
+                update &= production[:, -1] != 0
+
+        position = np.flatnonzero(update)
+        self.slot_key[position] = self.get_initial_key(self.slot_index[position])
+        self.slot_auto_consumption[position] = 0
+        self.compute_slots(position, progress, workers)
+        return len(position)
+
+    # This function returns priority of each consumer for each producer (consumers x producers)
+    def get_priority(self, cons_list):
+        return np.array([consumer.priority_list for consumer in cons_list], dtype=np.int64).reshape(len(cons_list), -1)
+
+    # This function returns ratio of each consumer for each producer (consumers x producers)
+    def get_ratio(self, cons_list):
+        return np.array([consumer.ratio_list for consumer in cons_list], dtype=np.float64).reshape(len(cons_list), -1)
+
+    # This function returns keys of given slots before computation: ratio of each consumer,
+    # or 0 when production of the last producer is null
+    def get_initial_key(self, slot_index=slice(None)):
+        return np.where(self.initial_production[slot_index, -1, np.newaxis, np.newaxis] != 0, self.ratio, 0.0)
+
+    # This function returns keys of slots [start, stop[ (slots x consumers x producers),
+    # or keys of one producer (slots x consumers)
+    # Keys of slots not stored are filled in: initial keys for slots not computed, 0 for computed slots
+    def get_key(self, start=0, stop=None, index_prod=None):
+        stop = len(self.initial_production) if stop is None else stop
+        ratio = self.ratio if index_prod is None else self.ratio[:, index_prod]
+        null_key = self.computed[start:stop] | (self.initial_production[start:stop, -1] == 0)
+        key = np.where(null_key.reshape((-1,) + (1,) * ratio.ndim), 0.0, ratio)
+        first, last = np.searchsorted(self.slot_index, (start, stop))
+        slot_key = self.slot_key[first:last] if index_prod is None else self.slot_key[first:last, :, index_prod]
+        key[self.slot_index[first:last] - start] = slot_key
+        return key
+
+    # This function returns auto_consumption of slots [start, stop[ (slots x consumers x producers),
+    # auto_consumption of slots not stored is 0
+    def get_auto_consumption(self, start=0, stop=None):
+        stop = len(self.initial_production) if stop is None else stop
+        auto_consumption = np.zeros((stop - start,) + self.slot_auto_consumption.shape[1:])
+        first, last = np.searchsorted(self.slot_index, (start, stop))
+        auto_consumption[self.slot_index[first:last] - start] = self.slot_auto_consumption[first:last]
+        return auto_consumption
+
+    # This function computes keys and auto_consumption of stored slots at given positions using initial keys
+    # Production not used by consumers is refreshed for all slots
+    def compute_slots(self, position, progress=None, workers=1):
+        stats = {'rounds': None, 'max_depth': None}
+        if len(position) > 0:
+            slot_index = self.slot_index[position]
+            # Priorities are only used by Strategy.DYNAMIC
+            priority = None
+            if self.type != Strategy.DYNAMIC_BY_DEFAULT:
+                priority = self.priority
+
+            if workers > 1 and len(slot_index) > Engine.BATCH_SIZE:
+                key, auto_consumption = Engine.compute_parallel(self.consumption[slot_index],
+                                                                self.initial_production[slot_index],
+                                                                priority,
+                                                                self.slot_key[position],
+                                                                workers=workers,
+                                                                progress=progress,
+                                                                stats=stats)
+            elif priority is None:
+                key, auto_consumption = Engine.compute_dynamic_by_default(self.consumption[slot_index],
+                                                                          self.initial_production[slot_index])
+                if progress is not None:
+                    progress(len(slot_index), len(slot_index))
+            else:
+                key, auto_consumption = Engine.compute_dynamic(self.consumption[slot_index],
+                                                               self.initial_production[slot_index],
+                                                               priority,
+                                                               self.slot_key[position],
+                                                               progress=progress,
+                                                               stats=stats)
+            self.slot_key[position] = key
+            self.slot_auto_consumption[position] = auto_consumption
+        self.engine_stats = dict(stats, slots=len(position))
+
+        # Refresh production by removing what has been consumed by consumers
+        self.production = self.initial_production.copy()
+        self.production[self.slot_index] -= self.slot_auto_consumption.sum(axis=1)
+
+    # This function returns timestamps of slots as text
+    def get_slot_list(self):
+        return Curve.format_timestamps(self.timestamps, self.date_format)
 
     # This function create files for repartition keys
     def write_repartition_key(self, prod_list, cons_list, folder, debug_info = False):
-        for index_prod, prod in enumerate(prod_list):
-            file = folder + str(prod.prm) + '.csv'
-            with open(file, 'w', newline='') as csvfile:
-                keywriter = csv.writer(csvfile,delimiter=';')
-
-                # Add first line with list of PRM
-                first_line = []
-                first_line.append('Horodate')
-                for prm in self.prm_list:
-                    first_line.append(str(prm))
-
-                if debug_info:
-                    # Start the debug information at the second line
-                    line_for_debug_info = 1
-                    first_line.append('TOTAL')
-
-                    # Compute the letter of column based on number of consumers
-                    # Add number of consumers + 2 columns  (Horodate and TOTAL)
-                    column_letter = 'A'
-                    column_letter = ord(column_letter[0]) + len(self.prm_list) + 2
-                    first_line.append('=NB.SI('+chr(column_letter)+'2:'+chr(column_letter)+'2881;"NOK")')
-                    line_for_debug_info += 1
-
-                keywriter.writerow(first_line)
-
-                # Iterate on each point
-                for row in self.point_list:
-                    # First add information of time slot
-                    row_key = []
-                    row_key.append(row.slot)
-                    # Then add key for each consumer
-                    for cons in row.cons_list:
-                        # Use this line to print float with ',' instead of '.'
-                        row_key.append(str(cons.param_list[index_prod].key).replace('.', ','))
-                        # row_key.append(cons.param_list[index_prod].key)
-
-                    if debug_info:
-                        # Add check information for excel
-                        line = '=SOMME('
-                        excel_column_number = 'A'
-                        excel_column_number = ord(excel_column_number[0])
-                        for cons in cons_list:
-                            excel_column_number += 1
-                            line += 'SUBSTITUE('+chr(excel_column_number)+str(line_for_debug_info)+';".";",");'
-                        excel_column_number +=1
-                        line = line[:-1]
-                        line = line + ')'
-                        row_key.append(line)
-                        line = '=SI('+chr(excel_column_number)+str(line_for_debug_info)+'>100;"NOK";"")'
-                        row_key.append(line)
-                        line_for_debug_info += 1
-
-                    keywriter.writerow(row_key)
-
-                print('Repartition key file written')
-
-    # This function extract month value
-    def get_month(self, slot):
-        if '.' in slot:
-            date_obj = datetime.strptime(slot[0:5], "%d.%m")
-        elif '/' in slot:
-            date_obj = datetime.strptime(slot[0:10], "%d/%m/%Y")
-
-        month = date_obj.month
-        return month
+        Export.export(self, prod_list, cons_list, [Export.KeySink(folder, debug_info)])
 
     # This function creates file with statistics (auto-consumption and auto-production)
     def generate_statistics(self,
@@ -386,68 +464,8 @@ class Repartition:
                             add_cons = False,
                             add_auto_cons = True,
                             add_auto_prod_rate = False):
-        file_list = []
-
-        for index_prod, prod in enumerate(prod_list):
-            file = folder + str(prod.prm) + '_statistics.csv'
-            file_list.append(file)
-            with open(file, 'w', newline='') as csvfile:
-                keywriter = csv.writer(csvfile,delimiter=';')
-
-                # Add first line with name of consumers
-                first_line = []
-                first_line.append('Horodate')
-                first_line.append(prod.name)
-                for cons in cons_list:
-                    if add_cons: first_line.append(cons.name + "\ncons")
-                    if add_auto_cons: first_line.append(cons.name + "\nauto_cons")
-                    if add_auto_prod_rate: first_line.append(cons.name + "\nauto_prod_rate")
-                first_line.append("auto_cons_rate")
-                keywriter.writerow(first_line)
-
-                # Iterate on each point
-                for row in self.point_list:
-                    # First add information of time slot
-                    row_key = []
-                    row_key.append(row.slot)
-                    row_key.append(str(row.prod_list[index_prod].initial_production))
-
-                    total_auto_consumption = 0
-
-                    # Then add key for each consumer
-                    for cons in row.cons_list:
-                        if add_cons:
-                            row_key.append(str(cons.consumption).replace('.', ','))
-
-                        if add_auto_cons:
-                            auto_cons = row.prod_list[index_prod].initial_production * cons.param_list[index_prod].key
-                            auto_cons = math.floor(auto_cons) / 100
-                            row_key.append(str(auto_cons).replace('.', ','))
-                            # row_key.append(cons.param_list[index_prod].key)
-
-                        if add_auto_prod_rate:
-                            if (cons.consumption != 0):
-                                auto_prod_rate = str(int(auto_cons * 100 / cons.consumption)).replace('.', ',')
-                            else:
-                                auto_prod_rate = 0
-                            row_key.append(auto_prod_rate)
-
-                        # Multiply by 100 and force to int to prevent having float representation issues
-                        total_auto_consumption += int(round(cons.param_list[index_prod].auto_consumption * 100))
-
-                    # Write auto consumption ratio
-                    if row.prod_list[index_prod].initial_production != 0:
-                        auto_cons_ratio = int(total_auto_consumption  / row.prod_list[index_prod].initial_production)
-                    else:
-                        auto_cons_ratio = 0
-
-                    row_key.append(auto_cons_ratio)
-
-                    keywriter.writerow(row_key)
-
-                print('File for statistics generated')
-
-            return file_list
+        sink = Export.StatisticsSink(folder, add_cons, add_auto_cons, add_auto_prod_rate)
+        return Export.export(self, prod_list, cons_list, [sink])[0]
 
     # Function used to generate monthly report
     def generate_monthly_report(self,
@@ -457,100 +475,22 @@ class Repartition:
                                 add_cons_mois = True,
                                 add_auto_prod_rate = True,
                                 add_auto_cons_mois = True):
-        for index_prod, prod in enumerate(prod_list):
-            file = folder + str(prod.prm) + '_monthly_report.csv'
-            with open(file, 'w', newline='') as csvfile:
-                keywriter = csv.writer(csvfile,delimiter=';')
-
-                # Add first line with name of consumers
-                first_line = []
-                first_line.append('Horodate')
-                first_line.append(prod.name + '\n prod')
-                for cons in cons_list:
-                    if add_cons_mois: first_line.append(cons.name + '\ncons_mois')
-                    if add_auto_prod_rate: first_line.append(cons.name + '\nauto_prod_rate')
-                    if add_auto_cons_mois: first_line.append(cons.name + '\nauto_cons_mois')
-                keywriter.writerow(first_line)
-
-                # Get first month
-                current_month = self.get_month(self.point_list[0].slot)
-
-                prod_month = 0
-                cons_month = [0 for i in range(len(self.point_list[0].cons_list))]
-                auto_cons_month = [0 for i in range(len(self.point_list[0].cons_list))]
-                total_auto_consumption = 0
-
-                # Iterate on each point
-                for row_index, row in enumerate(self.point_list):
-
-                    # Check if reaching end of file before getting next month
-                    if (row_index < len(self.point_list)-1):
-                        next_month = self.get_month(self.point_list[row_index+1].slot)
-                    else:
-                        next_month = 13
-
-                    prod_month += row.prod_list[0].initial_production
-
-                    # Then add key for each consumer
-                    for cons_index, cons in enumerate(row.cons_list):
-                        cons_month[cons_index] += cons.consumption
-
-                        auto_cons = row.prod_list[index_prod].initial_production * cons.param_list[index_prod].key
-                        auto_cons = auto_cons / 100
-                        auto_cons_month[cons_index] += auto_cons
-                        total_auto_consumption += auto_cons
-
-                    # If next month is different, write the values for the current month
-                    if next_month != current_month:
-                        # New month => write values for current month
-                        # First add information of time slot
-                        row_key = []
-                        row_key.append(row.slot)
-
-                        row_key.append(str(int(prod_month/1000)).replace('.', ','))
-
-                        for cons_index, cons in enumerate(row.cons_list):
-                            cons_kwh = int(cons_month[cons_index] / 1000)
-                            if add_cons_mois:
-                                row_key.append(str(cons_kwh).replace('.', ','))
-
-                            ratio = int(auto_cons_month[cons_index] * 10000 / cons_month[cons_index]) / 100
-                            if add_auto_prod_rate:
-                                row_key.append(str(ratio).replace('.', ','))
-
-                            auto_cons_kwh = int(auto_cons_month[cons_index] / 1000)
-                            if add_auto_cons_mois:
-                                row_key.append(str(auto_cons_kwh).replace('.', ','))
-
-                        # Reinitialize lists
-                        prod_month = 0
-                        cons_month = [0 for i in range(len(self.point_list[0].cons_list))]
-                        auto_cons_month = [0 for i in range(len(self.point_list[0].cons_list))]
-
-                        keywriter.writerow(row_key)
-
-                        current_month = next_month
-
-                print('Monthly report generated')
+        sink = Export.MonthlyReportSink(folder, add_cons_mois, add_auto_prod_rate, add_auto_cons_mois)
+        Export.export(self, prod_list, cons_list, [sink])
 
     # This function get auto_consumption rate for a specific producer
     # Auto_consumption rate is defined as:
     # (sum of auto_consumption for all users) / (production of producer)
     def get_auto_consumption_rate(self, index_producer):
 
-        total_auto_consumption = 0
-        total_production = 0
-        for row in self.point_list:
-
-            # First get all auto_consumption for the specific producer
-            for cons in row.cons_list:
-                total_auto_consumption += cons.param_list[index_producer].auto_consumption
+        # First get all auto_consumption for the specific producer
+        total_auto_consumption = Engine.sequential_total(self.slot_auto_consumption[:, :, index_producer])
 
-            # Then get sum of production
-            total_production += row.prod_list[index_producer].initial_production
+        # Then get sum of production
+        total_production = Engine.sequential_total(self.initial_production[:, index_producer])
 
         # Compute auto_consumption rate
-        auto_consumption_rate = int(total_auto_consumption * 1000 / total_production) / 10
+        auto_consumption_rate = Engine.get_rate(total_auto_consumption, total_production)
 
         return auto_consumption_rate
 
@@ -559,17 +499,11 @@ class Repartition:
     # (sum of auto_consumption) / (sum of consumption)
     def get_auto_production_rate(self, index_consumer):
 
-        total_auto_consumption = 0
-        total_consumption = 0
-        for row in self.point_list:
-
-            for param in row.cons_list[index_consumer].param_list:
-                total_auto_consumption += param.auto_consumption
-
-            total_consumption += row.cons_list[index_consumer].consumption
+        total_auto_consumption = Engine.sequential_total(self.slot_auto_consumption[:, index_consumer, :])
+        total_consumption = Engine.sequential_total(self.consumption[:, index_consumer])
 
         # Compute auto_production rate
-        auto_production_rate = int(total_auto_consumption * 1000 / total_consumption) / 10
+        auto_production_rate = Engine.get_rate(total_auto_consumption, total_consumption)
 
         return auto_production_rate
 
@@ -578,20 +512,11 @@ class Repartition:
     # (sum of auto_consumption of all consumers) / (sum of consumption of all consumers)
     def get_global_auto_production_rate(self, cons_list):
 
-        total_auto_consumption = 0
-        total_consumption = 0
-        for row in self.point_list:
-
-            for cons in row.cons_list:
-                for param in cons.param_list:
-                    total_auto_consumption += param.auto_consumption
-
-        for cons in cons_list:
-            for point in cons.point_list:
-                total_consumption += point.cons
+        total_auto_consumption = Engine.sequential_total(self.slot_auto_consumption)
+        total_consumption = self.get_total_consumption(cons_list)
 
         # Compute auto_production rate
-        global_auto_production_rate = int(total_auto_consumption * 1000 / total_consumption) / 10
+        global_auto_production_rate = Engine.get_rate(total_auto_consumption, total_consumption)
 
         return global_auto_production_rate
 
@@ -601,17 +526,14 @@ class Repartition:
     # (production of producer) / (sum of consumption of consumer)
     def get_coverage_rate(self, index_producer, cons_list):
 
-        total_production = 0
-        total_consumption = 0
-        for row in self.point_list:
-
-            total_production += row.prod_list[index_producer].initial_production
-
-        for cons in cons_list:
-            for point in cons.point_list:
-                total_consumption += point.cons
+        total_production = Engine.sequential_total(self.initial_production[:, index_producer])
+        total_consumption = self.get_total_consumption(cons_list)
 
         # Compute coverage rate
-        coverage_rate = int(total_production * 1000 / total_consumption) / 10
+        coverage_rate = Engine.get_rate(total_production, total_consumption)
+
+        return coverage_rate
 
-        return coverage_rate
\ No newline at end of file
+    # This function get sum of consumption of all consumers on their whole curve
+    def get_total_consumption(self, cons_list):
+        return Engine.sequential_total(np.concatenate([cons.consumption for cons in cons_list]))
@@ -0,0 +1,127 @@
+# This module is to define a cache of repartition results stored on disk
+# A result is identified by a hash of everything used to compute it:
+#   strategy, curves, names and prm of producers and consumers, priority and ratio lists
+# Curves of the curve repository are identified by the hash of their file, so they are not read.
+# Each entry is a folder containing export files and a result file with indicators.
+# When the size of the cache exceeds its limit, least recently used entries are removed.
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# Version of the cache, to change when results computed for the same inputs change
+CACHE_VERSION = 6
+
+# Default maximum size of the cache (bytes)
+MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# File of each entry containing indicators and names of files of the entry
+# In results, values of keys ending with '_file' are files, and '_file_list' are lists of files
+RESULT_FILE = 'result.json'
+
+# Extension of folders of entries being written
+TEMP_EXTENSION = '.tmp'
+
+
+# This function returns the key identifying a repartition result
+def compute_key(prod_list, cons_list, strategy):
+    digest = hashlib.sha256()
+    description = {
+        'version': CACHE_VERSION,
+        'strategy': strategy,
+        'producers': [[str(prod.name), str(prod.prm)] for prod in prod_list],
+        'consumers': [[str(cons.name), str(cons.prm), list(cons.priority_list), list(cons.ratio_list)]
+                      for cons in cons_list],
+    }
+    digest.update(json.dumps(description).encode('utf-8'))
+    # Curves of the curve repository are identified by their hash, other curves are hashed
+    for item in list(prod_list) + list(cons_list):
+        curve_digest = getattr(item.curve, 'digest', None)
+        if curve_digest is not None:
+            digest.update(b'repository:' + curve_digest.encode('ascii'))
+        else:
+            digest.update(b'curve:' + hashlib.sha256(item.curve.to_bytes()).digest())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, folder, max_size=MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    # This function returns the folder of an entry
+    def get_folder(self, key):
+        return os.path.join(self.folder, key, '')
+
+    # This function returns the result stored for a key, or None if there is none
+    # File names of the result are full paths in the folder of the entry
+    def get(self, key):
+        result_file = os.path.join(self.get_folder(key), RESULT_FILE)
+        try:
+            with open(result_file, encoding='utf-8') as file:
+                result = json.load(file)
+            # Date of last access is used to remove least recently used entries
+            os.utime(result_file)
+        except (OSError, ValueError):
+            return None
+        folder = self.get_folder(key)
+        for name, value in result.items():
+            if name.endswith('_file'):
+                result[name] = folder + value
+            elif name.endswith('_file_list'):
+                result[name] = [folder + file for file in value]
+        return result
+
+    # This function creates a temporary folder where files of a new entry are written
+    def create_entry(self, key, suffix):
+        folder = os.path.join(self.folder, key + '.' + suffix + TEMP_EXTENSION, '')
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    # This function stores a result whose files have been written in a temporary folder
+    # It returns the result as returned by get
+    def add(self, key, temp_folder, result):
+        result = dict(result)
+        for name, value in result.items():
+            if name.endswith('_file'):
+                result[name] = os.path.basename(value)
+            elif name.endswith('_file_list'):
+                result[name] = [os.path.basename(file) for file in value]
+        with open(os.path.join(temp_folder, RESULT_FILE), 'w', encoding='utf-8') as file:
+            json.dump(result, file)
+
+        with self.lock:
+            try:
+                os.rename(os.path.normpath(temp_folder), os.path.normpath(self.get_folder(key)))
+            except OSError:
+                # Same result has been stored in the meantime
+                shutil.rmtree(temp_folder, ignore_errors=True)
+            self.remove_old_entries(keep=key)
+        return self.get(key)
+
+    # This function removes least recently used entries until the size of the cache is below its limit
+    # Lock must be held by the caller
+    def remove_old_entries(self, keep=None):
+        entry_list = []
+        total_size = 0
+        for entry in os.scandir(self.folder):
+            if not entry.is_dir() or entry.name.endswith(TEMP_EXTENSION):
+                continue
+            try:
+                last_access = os.stat(os.path.join(entry.path, RESULT_FILE)).st_mtime
+                size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+            except OSError:
+                continue
+            entry_list.append((last_access, entry.name, size))
+            total_size += size
+
+        entry_list.sort()
+        for last_access, name, size in entry_list:
+            if total_size <= self.max_size:
+                break
+            if name != keep:
+                shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+                total_size -= size
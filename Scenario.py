@@ -0,0 +1,174 @@
+# This module is to evaluate several scenarios of repartition in one run
+# A scenario changes the strategy, a factor applied to production of each producer (as
+# Producer.apply_factor), and priority and ratio of consumers.
+# Curves are aligned once and shared by all scenarios, which only scale production and compute keys.
+# Scenarios are independent, so they are evaluated on several processes.
+import itertools
+import os
+
+import numpy as np
+
+import Alignment
+import Engine
+import Repartition
+
+
+# The following class describes one scenario
+class Scenario:
+
+    def __init__(self, strategy, factor_list=None, priority_list=None, ratio_list=None, name=''):
+        self.strategy = strategy
+        # Factor applied to production of each producer, None to keep production
+        self.factor_list = factor_list
+        # Priority and ratio of each consumer for each producer (consumers x producers),
+        # None to keep the ones of consumers
+        self.priority_list = priority_list
+        self.ratio_list = ratio_list
+        self.name = name
+
+    # This function returns the scenario as a dictionary
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'strategy': self.strategy,
+            'factor_list': self.factor_list,
+            'priority_list': self.priority_list,
+            'ratio_list': self.ratio_list
+        }
+
+
+# This function returns scenarios of all combinations of strategies, production factors and settings
+# setting_list contains (priority_list, ratio_list) of consumers, None to keep the ones of consumers
+def build_grid(strategy_list, factor_grid=None, setting_list=None):
+    scenario_list = []
+    for strategy, factor_list, setting in itertools.product(strategy_list, factor_grid or [None], setting_list or [None]):
+        priority_list, ratio_list = setting if setting is not None else (None, None)
+        scenario_list.append(Scenario(strategy, factor_list, priority_list, ratio_list,
+                                      name='scenario_' + str(len(scenario_list) + 1)))
+    return scenario_list
+
+
+# The following class contains curves shared by all scenarios
+class Context:
+
+    def __init__(self, prod_list, cons_list):
+        item_list = list(prod_list) + list(cons_list)
+        self.timestamps, values, missing = Alignment.align([item.curve for item in item_list])
+        Alignment.check_missing([item.name for item in item_list], missing, len(self.timestamps))
+        self.production = values[:, :len(prod_list)]
+        self.consumption = values[:, len(prod_list):]
+        # Priority and ratio of consumers (consumers x producers)
+        rep = Repartition.Repartition()
+        self.priority = rep.get_priority(cons_list)
+        self.ratio = rep.get_ratio(cons_list)
+        # Consumption of all consumers on their whole curve, as Repartition.get_total_consumption
+        self.total_consumption = Engine.sequential_total(np.concatenate([cons.consumption for cons in cons_list]))
+
+
+# This function computes the repartition of a scenario and returns its indicators
+# Totals of auto_consumption are also returned, as rates are rounded
+def evaluate_scenario(production, consumption, priority, ratio, total_consumption, scenario):
+    rep = Repartition.Repartition()
+    rep.initial_production = production
+    if scenario.factor_list is not None:
+        rep.initial_production = production * np.asarray(scenario.factor_list, dtype=np.float64)
+    rep.consumption = consumption
+    if scenario.priority_list is not None:
+        priority = np.array(scenario.priority_list, dtype=np.int64).reshape(priority.shape)
+    if scenario.ratio_list is not None:
+        ratio = np.array(scenario.ratio_list, dtype=np.float64).reshape(ratio.shape)
+    rep.compute_rep(scenario.strategy, priority, ratio)
+
+    nb_prod = production.shape[1]
+    total_auto_consumption = Engine.sequential_total(rep.slot_auto_consumption)
+    return {
+        'auto_consumption_rate': rep.get_auto_consumption_rate(0),
+        'auto_consumption_rate_list': [rep.get_auto_consumption_rate(index_prod) for index_prod in range(nb_prod)],
+        'auto_production_rate_global': Engine.get_rate(total_auto_consumption, total_consumption),
+        'coverage_rate': Engine.get_rate(Engine.sequential_total(rep.initial_production[:, 0]), total_consumption),
+        'auto_consumption': total_auto_consumption,
+        'auto_consumption_list': [Engine.sequential_total(rep.slot_auto_consumption[:, index_cons, :])
+                                  for index_cons in range(consumption.shape[1])]
+    }
+
+
+# This function evaluates a scenario in a worker process, curves are read from shared memory
+def evaluate_shared(description_dict, priority, ratio, total_consumption, scenario):
+    block_list = []
+    array_dict = {}
+    try:
+        for name, description in description_dict.items():
+            block, array_dict[name] = Engine.open_shared_array(description)
+            block_list.append(block)
+        return evaluate_scenario(array_dict['prod'], array_dict['cons'], priority, ratio, total_consumption, scenario)
+    finally:
+        # Arrays must be released before closing the blocks they use
+        array_dict.clear()
+        for block in block_list:
+            block.close()
+
+
+# The following class evaluates batches of scenarios on the same curves
+# With several workers, curves are copied once in shared memory and processes are kept
+# between batches, until the evaluator is closed
+class Evaluator:
+
+    def __init__(self, context, workers=1):
+        self.context = context
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.executor = None
+        self.block_list = []
+        self.shared_list = []
+        self.description_dict = {}
+        if self.workers > 1:
+            for name, array in (('prod', context.production), ('cons', context.consumption)):
+                block, shared, self.description_dict[name] = Engine.share_array(array)
+                self.block_list.append(block)
+                self.shared_list.append(shared)
+            self.executor = Engine.create_executor(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # This function returns indicators of each scenario
+    # progress is called after each scenario with the number of scenarios evaluated and the number of scenarios
+    def evaluate(self, scenario_list, progress=None):
+        context = self.context
+        if self.executor is None or len(scenario_list) <= 1:
+            result_list = (evaluate_scenario(context.production, context.consumption, context.priority,
+                                             context.ratio, context.total_consumption, scenario)
+                           for scenario in scenario_list)
+        else:
+            future_list = [self.executor.submit(evaluate_shared, self.description_dict, context.priority,
+                                                context.ratio, context.total_consumption, scenario)
+                           for scenario in scenario_list]
+            result_list = (future.result() for future in future_list)
+
+        indicator_list = []
+        for indicators in result_list:
+            indicator_list.append(indicators)
+            if progress is not None:
+                progress(len(indicator_list), len(scenario_list))
+        return indicator_list
+
+    # This function stops worker processes and releases shared memory
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.shared_list.clear()
+        for block in self.block_list:
+            block.close()
+            block.unlink()
+        self.block_list = []
+
+
+# This function evaluates scenarios and returns one row per scenario: the scenario and its indicators
+# progress is called after each scenario with the number of scenarios evaluated and the number of scenarios
+def evaluate(prod_list, cons_list, scenario_list, workers=1, progress=None):
+    with Evaluator(Context(prod_list, cons_list), workers) as evaluator:
+        indicator_list = evaluator.evaluate(scenario_list, progress)
+    return [dict(scenario.to_dict(), **indicators) for scenario, indicators in zip(scenario_list, indicator_list)]
@@ -1,20 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
+import shutil
+import threading
 import json
 import pickle
 
+import functools
+import gzip
+import hashlib
 import io
+import logging
 import csv
 
+import Aggregation
+import Chart
 import Consumer
+import Curve
+import CurveRepository
+import Export
 import Producer
 import Repartition
-import Graph
+import ResultCache
+import Scenario
+import Jobs
+import Metrics
+import Optimizer
 
-import plotly.graph_objects as go
+import numpy as np
 import plotly.utils
 
 app = Flask(__name__)
@@ -23,17 +38,24 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
 app.config['UPLOAD_FOLDER'] = 'C:\\Pro\\Git\\RepartKey_UI\\Courbes\\'
+# Dossier des courbes converties au format binaire, partagé entre les processus
+app.config['CURVE_FOLDER'] = 'C:\\Pro\\Git\\RepartKey_UI\\Courbes\\Binaire\\'
 EXPORT_FOLDER = 'C:\\Pro\\Git\\RepartKey_UI\\Export\\'
 ALLOWED_EXTENSIONS = {'csv'}
+# Nombre de processus utilisés pour calculer les clés de répartition
+app.config['COMPUTE_WORKERS'] = os.cpu_count() or 1
+# Garder une copie des fichiers de courbes envoyés dans UPLOAD_FOLDER, en plus du format binaire
+app.config['KEEP_UPLOADED_FILES'] = False
+# Export en colonnes typées en plus des fichiers csv : None, 'parquet' ou 'arrow' (nécessite pyarrow)
+app.config['COLUMNAR_EXPORT'] = Export.PARQUET if Export.is_columnar_available() else None
 
-auto_consumption_rate = 0
-auto_production_rate_global = 0
-coverage_rate = 0
+curve_repository = CurveRepository.CurveRepository(app.config['CURVE_FOLDER'])
 
-stat_file_list = []
+# Calculs des clés de répartition lancés en arrière-plan, avec leurs résultats
+job_queue = Jobs.JobQueue()
 
-# Global variables used to manage interactions between different blocs
-stat_file_generated = False
+# Résultats déjà calculés (fichiers d'export et indicateurs), un dossier par résultat
+result_cache = ResultCache.ResultCache(EXPORT_FOLDER)
 
 
 class TextBlock(db.Model):
@@ -51,23 +73,23 @@ class ConsumerBlock(db.Model):
     cons_name = db.Column(db.String(100), nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def get_consumer_object(self):
+    def get_consumer_object(self, with_curve=True):
         """Retourne l'objet Consumer associé"""
         consumer_obj = ConsumerObject.query.filter_by(consumer_block_id=self.id).first()
         if consumer_obj:
-            return consumer_obj.get_consumer_object()
+            return consumer_obj.get_consumer_object(with_curve)
         return None
 
     def get_priority_for_producer(self, producer_index):
         """Retourne la priorité pour un producteur spécifique"""
-        consumer = self.get_consumer_object()
+        consumer = self.get_consumer_object(with_curve=False)
         if consumer and producer_index < len(consumer.priority_list):
             return consumer.priority_list[producer_index]
         return 0  # Valeur par défaut
 
     def get_ratio_for_producer(self, producer_index):
         """Retourne le ratio pour un producteur spécifique"""
-        consumer = self.get_consumer_object()
+        consumer = self.get_consumer_object(with_curve=False)
         if consumer and producer_index < len(consumer.ratio_list):
             return consumer.ratio_list[producer_index]
         return 0  # Valeur par défaut
@@ -76,15 +98,15 @@ class ConsumerBlock(db.Model):
         """Définit la priorité pour un producteur spécifique"""
         consumer_obj_record = ConsumerObject.query.filter_by(consumer_block_id=self.id).first()
         if consumer_obj_record:
-            consumer = consumer_obj_record.get_consumer_object()
+            # La courbe n'est pas chargée : seule la colonne JSON est modifiée
+            consumer = consumer_obj_record.get_consumer_object(with_curve=False)
             if consumer:
                 # Étendre la liste si nécessaire
                 while len(consumer.priority_list) <= producer_index:
                     consumer.priority_list.append(0)
                 consumer.priority_list[producer_index] = int(value)
 
-                # Sauvegarder l'objet modifié
-                consumer_obj_record.set_consumer_object(consumer)
+                # Sauvegarder la liste modifiée
                 consumer_obj_record.priority_list = json.dumps(consumer.priority_list)
                 db.session.commit()
 
@@ -92,15 +114,15 @@ class ConsumerBlock(db.Model):
         """Définit le ratio pour un producteur spécifique"""
         consumer_obj_record = ConsumerObject.query.filter_by(consumer_block_id=self.id).first()
         if consumer_obj_record:
-            consumer = consumer_obj_record.get_consumer_object()
+            # La courbe n'est pas chargée : seule la colonne JSON est modifiée
+            consumer = consumer_obj_record.get_consumer_object(with_curve=False)
             if consumer:
                 # Étendre la liste si nécessaire
                 while len(consumer.ratio_list) <= producer_index:
                     consumer.ratio_list.append(0)
                 consumer.ratio_list[producer_index] = int(value)
 
-                # Sauvegarder l'objet modifié
-                consumer_obj_record.set_consumer_object(consumer)
+                # Sauvegarder la liste modifiée
                 consumer_obj_record.ratio_list = json.dumps(consumer.ratio_list)
                 db.session.commit()
 
@@ -117,6 +139,15 @@ class ProducerBlock(db.Model):
         return f'<ProducerBlock {self.prod_name}>'
 
 
+def load_curve(data):
+    """Retourne la courbe stockée en base (les anciens enregistrements contiennent l'objet sérialisé avec pickle)"""
+    if not data:
+        return Curve.Curve.empty()
+    if Curve.is_curve_data(data):
+        return Curve.Curve.from_bytes(data)
+    return pickle.loads(data).curve
+
+
 # Nouveaux modèles SQLAlchemy pour stocker les objets Consumer et Producer
 class ConsumerObject(db.Model):
     __tablename__ = 'consumer_objects'
@@ -127,21 +158,31 @@ class ConsumerObject(db.Model):
     file_path = db.Column(db.String(255), nullable=False)
     priority_list = db.Column(db.Text, default='[]')  # JSON des priorités
     ratio_list = db.Column(db.Text, default='[]')  # JSON des ratios
-    object_data = db.Column(db.LargeBinary, nullable=True)  # Objet sérialisé (pickle)
+    # Courbe au format binaire (voir Curve.to_bytes), chargée uniquement à la demande
+    object_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relation avec ConsumerBlock
     consumer_block = db.relationship('ConsumerBlock', backref='consumer_object')
 
-    def set_consumer_object(self, consumer_obj):
-        """Sérialise et stocke l'objet Consumer"""
-        self.object_data = pickle.dumps(consumer_obj)
-
-    def get_consumer_object(self):
-        """Désérialise et retourne l'objet Consumer"""
-        if self.object_data:
-            return pickle.loads(self.object_data)
-        return None
+    def set_curve(self, curve):
+        """Stocke la courbe de consommation au format binaire"""
+        self.object_data = curve.to_bytes()
+
+    def get_curve(self):
+        """Retourne la courbe de consommation stockée"""
+        return load_curve(self.object_data)
+
+    def get_consumer_object(self, with_curve=True):
+        """Reconstruit l'objet Consumer à partir des colonnes et de la courbe"""
+        consumer = Consumer.Consumer(self.consumer_name, self.consumer_name,
+                                     json.loads(self.priority_list or '[]'), json.loads(self.ratio_list or '[]'))
+        if with_curve:
+            if CurveRepository.is_curve_file(self.file_path):
+                consumer.open_consumption(self.file_path)
+            else:
+                consumer.curve = self.get_curve()
+        return consumer
 
     def __repr__(self):
         return f'<ConsumerObject {self.consumer_name}>'
@@ -155,21 +196,30 @@ class ProducerObject(db.Model):
     producer_name = db.Column(db.String(100), nullable=False)
     file_path = db.Column(db.String(255), nullable=False)
     producer_id_number = db.Column(db.BigInteger, default=1234567901000)
-    object_data = db.Column(db.LargeBinary, nullable=True)  # Objet sérialisé (pickle)
+    # Courbe au format binaire (voir Curve.to_bytes), chargée uniquement à la demande
+    object_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relation avec ProducerBlock
     producer_block = db.relationship('ProducerBlock', backref='producer_object')
 
-    def set_producer_object(self, producer_obj):
-        """Sérialise et stocke l'objet Producer"""
-        self.object_data = pickle.dumps(producer_obj)
+    def set_curve(self, curve):
+        """Stocke la courbe de production au format binaire"""
+        self.object_data = curve.to_bytes()
 
-    def get_producer_object(self):
-        """Désérialise et retourne l'objet Producer"""
-        if self.object_data:
-            return pickle.loads(self.object_data)
-        return None
+    def get_curve(self):
+        """Retourne la courbe de production stockée"""
+        return load_curve(self.object_data)
+
+    def get_producer_object(self, with_curve=True):
+        """Reconstruit l'objet Producer à partir des colonnes et de la courbe"""
+        producer = Producer.Producer(self.producer_name, self.producer_id_number)
+        if with_curve:
+            if CurveRepository.is_curve_file(self.file_path):
+                producer.open_production(self.file_path)
+            else:
+                producer.curve = self.get_curve()
+        return producer
 
     def __repr__(self):
         return f'<ProducerObject {self.producer_name}>'
@@ -209,7 +259,7 @@ def save_consumer(consumer_block_id, consumer_obj, consumer_name, file_path, pri
         existing.file_path = file_path
         existing.priority_list = json.dumps(priorities)
         existing.ratio_list = json.dumps(ratios)
-        existing.set_consumer_object(consumer_obj)
+        existing.set_curve(consumer_obj.curve)
     else:
         # Créer un nouvel objet
         new_consumer_obj = ConsumerObject(
@@ -219,7 +269,7 @@ def save_consumer(consumer_block_id, consumer_obj, consumer_name, file_path, pri
             priority_list=json.dumps(priorities),
             ratio_list=json.dumps(ratios)
         )
-        new_consumer_obj.set_consumer_object(consumer_obj)
+        new_consumer_obj.set_curve(consumer_obj.curve)
         db.session.add(new_consumer_obj)
 
     db.session.commit()
@@ -234,15 +284,17 @@ def save_producer(producer_block_id, producer_obj, producer_name, file_path):
         # Mettre à jour l'objet existant
         existing.producer_name = producer_name
         existing.file_path = file_path
-        existing.set_producer_object(producer_obj)
+        existing.producer_id_number = producer_obj.prm
+        existing.set_curve(producer_obj.curve)
     else:
         # Créer un nouvel objet
         new_producer_obj = ProducerObject(
             producer_block_id=producer_block_id,
             producer_name=producer_name,
-            file_path=file_path
+            file_path=file_path,
+            producer_id_number=producer_obj.prm
         )
-        new_producer_obj.set_producer_object(producer_obj)
+        new_producer_obj.set_curve(producer_obj.curve)
         db.session.add(new_producer_obj)
 
     db.session.commit()
@@ -303,13 +355,12 @@ def update_all_consumers_for_new_producer():
     """Met à jour tous les consumers existants quand un nouveau producteur est ajouté"""
     consumer_objects = ConsumerObject.query.all()
     for consumer_obj_record in consumer_objects:
-        consumer = consumer_obj_record.get_consumer_object()
+        consumer = consumer_obj_record.get_consumer_object(with_curve=False)
         if consumer:
             # Ajouter une valeur pour le nouveau producteur
             consumer.add_producer_values()
 
-            # Sauvegarder l'objet modifié
-            consumer_obj_record.set_consumer_object(consumer)
+            # Sauvegarder les listes modifiées
             consumer_obj_record.priority_list = json.dumps(consumer.priority_list)
             consumer_obj_record.ratio_list = json.dumps(consumer.ratio_list)
 
@@ -321,7 +372,7 @@ def update_all_consumers_for_deleted_producer(producer_index):
     """Met à jour tous les consumers existants quand un producteur est supprimé"""
     consumer_objects = ConsumerObject.query.all()
     for consumer_obj_record in consumer_objects:
-        consumer = consumer_obj_record.get_consumer_object()
+        consumer = consumer_obj_record.get_consumer_object(with_curve=False)
         if consumer:
             # Supprimer les valeurs correspondant au producteur supprimé
             if producer_index < len(consumer.priority_list):
@@ -329,8 +380,7 @@ def update_all_consumers_for_deleted_producer(producer_index):
             if producer_index < len(consumer.ratio_list):
                 consumer.ratio_list.pop(producer_index)
 
-            # Sauvegarder l'objet modifié
-            consumer_obj_record.set_consumer_object(consumer)
+            # Sauvegarder les listes modifiées
             consumer_obj_record.priority_list = json.dumps(consumer.priority_list)
             consumer_obj_record.ratio_list = json.dumps(consumer.ratio_list)
 
@@ -417,7 +467,17 @@ def update_consumer_data():
         elif field_type == 'ratio':
             consumer_block.set_ratio_for_producer(producer_index, value)
 
-        return jsonify({'success': True, 'message': 'Données mises à jour'})
+        result = {'success': True, 'message': 'Données mises à jour'}
+
+        # Mettre à jour les indicateurs du calcul affiché sans tout recalculer
+        job_id = data.get('job_id')
+        job = job_queue.get(job_id) if job_id else None
+        if job is not None and job.context is not None:
+            indicators = update_job_indicators(job)
+            if indicators is not None:
+                result['indicators'] = {name: round(value, 2) for name, value in indicators.items()}
+
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -529,6 +589,13 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def get_upload_path(filename):
+    """Retourne le chemin de la copie d'un fichier envoyé, ou None si elle n'est pas gardée"""
+    if not app.config['KEEP_UPLOADED_FILES']:
+        return None
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+
 @app.route('/upload_consumer_file', methods=['POST'])
 def upload_consumer_file():
     cons_name = request.form.get('cons_name')
@@ -546,22 +613,22 @@ def upload_consumer_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
 
         # Récupérer l'objet Consumer existant
         consumer_obj_record = ConsumerObject.query.filter_by(consumer_block_id=int(consumer_id)).first()
         if consumer_obj_record:
-            consumer = consumer_obj_record.get_consumer_object()
+            # La courbe précédente n'est pas chargée, elle est remplacée
+            consumer = consumer_obj_record.get_consumer_object(with_curve=False)
             if consumer:
-                # Utiliser la méthode read_consumption pour charger les données
-                consumer.read_consumption(filepath)
-
-                # Mettre à jour l'enregistrement
-                consumer_obj_record.file_path = filepath
-                consumer_obj_record.set_consumer_object(consumer)
-                consumer_obj_record.priority_list = json.dumps(consumer.priority_list)
-                consumer_obj_record.ratio_list = json.dumps(consumer.ratio_list)
+                # Convertir le fichier au format binaire pendant sa lecture (une seule fois pour un même contenu)
+                try:
+                    curve_path = curve_repository.add_stream(file.stream, filename, get_upload_path(filename))
+                except Curve.CurveFormatError as e:
+                    return jsonify({'success': False, 'message': f'Fichier invalide : {str(e)}'})
+
+                # Mettre à jour l'enregistrement : la courbe est lue depuis le dépôt
+                consumer_obj_record.file_path = curve_path
+                consumer_obj_record.object_data = None
                 db.session.commit()
 
                 return jsonify({'success': True, 'message': 'File uploaded successfully'})
@@ -588,20 +655,22 @@ def upload_producer_file():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
 
         # Récupérer l'objet Producer existant
         producer_obj_record = ProducerObject.query.filter_by(producer_block_id=int(producer_id)).first()
         if producer_obj_record:
-            producer = producer_obj_record.get_producer_object()
+            # La courbe précédente n'est pas chargée, elle est remplacée
+            producer = producer_obj_record.get_producer_object(with_curve=False)
             if producer:
-                # Utiliser la méthode read_production pour charger les données
-                producer.read_production(filepath)
-
-                # Mettre à jour l'enregistrement
-                producer_obj_record.file_path = filepath
-                producer_obj_record.set_producer_object(producer)
+                # Convertir le fichier au format binaire pendant sa lecture (une seule fois pour un même contenu)
+                try:
+                    curve_path = curve_repository.add_stream(file.stream, filename, get_upload_path(filename))
+                except Curve.CurveFormatError as e:
+                    return jsonify({'success': False, 'message': f'Fichier invalide : {str(e)}'})
+
+                # Mettre à jour l'enregistrement : la courbe est lue depuis le dépôt
+                producer_obj_record.file_path = curve_path
+                producer_obj_record.object_data = None
                 db.session.commit()
 
                 return jsonify({'success': True, 'message': 'File uploaded successfully', 'filename': filename})
@@ -612,35 +681,145 @@ def upload_producer_file():
             {'success': False, 'message': f'Invalid file type. Allowed types: {", ".join(ALLOWED_EXTENSIONS)}'})
 
 
-@app.route('/compute_repartition_keys', methods=['POST'])
-def compute_repartition_keys():
-    global auto_consumption_rate
-    global auto_production_rate_global
-    global coverage_rate
+def compute_repartition_job(job, prod_list, cons_list, strategy, key_type, cache_key):
+    """Calcule les clés de répartition, les fichiers d'export et les indicateurs dans un job"""
+    job.step = 'Calcul des clés de répartition'
+    rep = Repartition.Repartition()
+    # Utiliser la stratégie sélectionnée au lieu de DYNAMIC_BY_DEFAULT
+    with Metrics.timer('build_rep', strategy=key_type):
+        rep.build_rep(prod_list, cons_list, strategy, progress=job.set_progress, workers=app.config['COMPUTE_WORKERS'])
+    Metrics.record_engine_stats(rep.engine_stats, strategy=key_type)
+
+    job.step = 'Écriture des fichiers et calcul des indicateurs'
+    result = export_repartition(job, rep, prod_list, cons_list, key_type, cache_key)
+
+    # Garder la répartition en mémoire pour recalculer seulement les créneaux concernés
+    # quand une priorité ou un ratio est modifié
+    job.context = {'repartition': rep, 'prod_list': prod_list, 'cons_list': cons_list, 'strategy': strategy,
+                   'key_type': key_type, 'lock': threading.Lock()}
+
+    job.step = 'Terminé'
+    return result
+
+
+def export_repartition(job, rep, prod_list, cons_list, key_type, cache_key):
+    """Écrit les fichiers d'export et les séries du graphique d'une répartition dans le cache,
+    et retourne le résultat avec les indicateurs"""
+    # Les fichiers sont écrits dans un dossier temporaire, puis ajoutés au cache
+    folder = result_cache.create_entry(cache_key, job.id)
+    try:
+        # Un seul parcours des résultats pour écrire tous les fichiers et calculer les indicateurs
+        sink_list = [
+            Export.KeySink(folder, debug_info=True),
+            Export.StatisticsSink(folder),
+            Export.MonthlyReportSink(folder, add_cons_mois=False),
+            Export.IndicatorSink(),
+            Export.AggregateSink(folder)
+        ]
+        if app.config['COLUMNAR_EXPORT']:
+            sink_list.append(Export.ColumnarSink(folder, app.config['COLUMNAR_EXPORT']))
+        with Metrics.timer('export', strategy=key_type):
+            (key_file_list, stat_file_list, report_file_list, indicators, aggregate_file_list,
+             *columnar_result) = Export.export(rep, prod_list, cons_list, sink_list)
+        columnar_file_list = columnar_result[0] if columnar_result else []
+        Metrics.log('indicators', level=logging.DEBUG, job=job.id, **indicators)
+
+        # Séries agrégées par heure, jour et mois, lues directement par /data
+        pyramid_file = folder + 'pyramid.npz'
+        with Metrics.timer('pyramid', strategy=key_type):
+            Aggregation.build_auto_consumption_pyramid(rep, cons_list).save(pyramid_file)
+
+        Metrics.registry.increment('repartition_bytes_written_total', get_folder_size(folder), strategy=key_type)
+    except Exception:
+        # Ne pas laisser de fichiers incomplets dans le cache
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+
+    return result_cache.add(cache_key, folder, {
+        'key_type': key_type,
+        'stat_file_list': stat_file_list,
+        'aggregate_file_list': aggregate_file_list,
+        'pyramid_file': pyramid_file,
+        'columnar_file_list': columnar_file_list,
+        'indicators': indicators
+    })
+
+
+def get_folder_size(folder):
+    """Retourne la taille en octets des fichiers d'un dossier"""
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+
+def run_profiled(job, function, *args):
+    """Exécute un job avec cProfile, le rapport est lu avec /job_profile"""
+    result, job.profile = Metrics.profile_call(function, job, *args)
+    return result
+
+
+def update_job_indicators(job):
+    """Met à jour la répartition d'un calcul terminé avec les priorités et ratios actuels
+    et retourne les nouveaux indicateurs, ou None si un recalcul complet est nécessaire"""
+    # Seules les priorités et ratios sont lus, les courbes sont celles du calcul
+    consumer_list = [record.get_consumer_object(with_curve=False) for record in ConsumerObject.query.all()]
+    # Le contexte est libéré quand un calcul plus récent se termine
+    context = job.context
+    if context is None:
+        return None
+    cons_list = context['cons_list']
+    if [consumer.prm for consumer in consumer_list] != [consumer.prm for consumer in cons_list]:
+        return None
+
+    with context['lock']:
+        rep = context['repartition']
+        try:
+            with Metrics.timer('update_rep'):
+                slot_count = rep.update_rep(consumer_list, workers=app.config['COMPUTE_WORKERS'])
+        except ValueError:
+            return None
+        Metrics.record_engine_stats(rep.engine_stats)
+        Metrics.log('update_rep', job=job.id, slots=slot_count)
+
+        # Les courbes du calcul sont gardées, avec les nouvelles priorités et ratios
+        for cons, consumer in zip(cons_list, consumer_list):
+            cons.priority_list = consumer.priority_list
+            cons.ratio_list = consumer.ratio_list
+
+        # Le résultat du calcul est remplacé : fichiers, séries du graphique et indicateurs
+        # correspondent aux nouveaux paramètres (déjà dans le cache ou écrits à nouveau)
+        cache_key = ResultCache.compute_key(context['prod_list'], cons_list, context['strategy'])
+        result = result_cache.get(cache_key)
+        if result is None:
+            result = export_repartition(job, rep, context['prod_list'], cons_list, context['key_type'], cache_key)
+        job.result = result
+        return result['indicators']
+
+
+# Mapping des valeurs du formulaire vers les stratégies
+STRATEGY_MAPPING = {
+    'default': Repartition.Strategy.DYNAMIC_BY_DEFAULT,
+    'dynamic': Repartition.Strategy.DYNAMIC,
+    'static': Repartition.Strategy.STATIC
+}
 
-    global stat_file_list
-    global stat_file_generated
 
+@app.route('/compute_repartition_keys', methods=['POST'])
+def compute_repartition_keys():
     try:
         # Récupérer le type de clés de répartition depuis le formulaire
         key_type = request.form.get('cles', 'default')  # 'default' par défaut si non spécifié
 
-        # Mapping des valeurs du formulaire vers les stratégies
-        strategy_mapping = {
-            'default': Repartition.Strategy.DYNAMIC_BY_DEFAULT,
-            'dynamic': Repartition.Strategy.DYNAMIC,
-            'static': Repartition.Strategy.STATIC
-        }
-
         # Récupérer la stratégie correspondante
-        strategy = strategy_mapping.get(key_type, Repartition.Strategy.DYNAMIC_BY_DEFAULT)
+        strategy = STRATEGY_MAPPING.get(key_type, Repartition.Strategy.DYNAMIC_BY_DEFAULT)
 
         print(f"Type de clés sélectionné : {key_type}")
         print(f"Stratégie utilisée : {strategy}")
 
+        Metrics.registry.increment('repartition_requests_total', strategy=key_type)
+
         # Récupérer les listes depuis SQLAlchemy
-        prod_list = get_prod_list()
-        cons_list = get_cons_list()
+        with Metrics.timer('load_curves'):
+            prod_list = get_prod_list()
+            cons_list = get_cons_list()
 
         # Vérifier qu'il y a des producteurs et consommateurs
         if not prod_list:
@@ -649,81 +828,217 @@ def compute_repartition_keys():
         if not cons_list:
             return jsonify({'success': False, 'message': 'Aucun consommateur ajouté'})
 
-        rep = Repartition.Repartition()
-        # Utiliser la stratégie sélectionnée au lieu de DYNAMIC_BY_DEFAULT
-        rep.build_rep(prod_list, cons_list, strategy)
-        rep.write_repartition_key(prod_list, cons_list, EXPORT_FOLDER, True)
+        # Résultat déjà calculé avec les mêmes courbes, paramètres et stratégie : pas de nouveau calcul
+        cache_key = ResultCache.compute_key(prod_list, cons_list, strategy)
+        result = result_cache.get(cache_key)
+        if result is not None:
+            job = job_queue.add_done(result)
+        elif request.form.get('profile', request.args.get('profile')) == '1':
+            # Profilage du calcul avec cProfile si demandé (profile=1), rapport lu avec /job_profile
+            job = job_queue.submit(run_profiled, compute_repartition_job, prod_list, cons_list, strategy, key_type,
+                                   cache_key)
+        else:
+            # Le calcul est fait en arrière-plan, le client suit son avancement avec /job_status
+            job = job_queue.submit(compute_repartition_job, prod_list, cons_list, strategy, key_type, cache_key)
+
+        return jsonify({
+            'success': True,
+            'message': f'Calcul des clés de répartition lancé (Stratégie: {key_type})',
+            'job_id': job.id
+        })
 
-        stat_file_list = rep.generate_statistics(prod_list, cons_list, EXPORT_FOLDER)
-        stat_file_generated = True
-        rep.generate_monthly_report(prod_list, cons_list, EXPORT_FOLDER, add_cons_mois=False)
+    except Exception as e:
+        print(f"Erreur lors du calcul : {str(e)}")
+        return jsonify({'success': False, 'message': f'Erreur lors du calcul : {str(e)}'})
+
+
+def evaluate_scenarios_job(job, prod_list, cons_list, scenario_list):
+    """Évalue des scénarios dans un job et retourne les indicateurs de chaque scénario"""
+    job.step = 'Évaluation des scénarios'
+    row_list = Scenario.evaluate(prod_list, cons_list, scenario_list,
+                                 workers=app.config['COMPUTE_WORKERS'], progress=job.set_progress)
+    job.step = 'Terminé'
+    return {'scenario_list': row_list}
+
+
+@app.route('/scenarios', methods=['POST'])
+def evaluate_scenarios():
+    """Lance l'évaluation de toutes les combinaisons de stratégies, facteurs de production
+    et priorités/ratios, par exemple :
+        {"strategies": ["default", "dynamic"],
+         "factors": [[1.0], [1.5], [2.0]],
+         "settings": [{"priority": [[1], [2]], "ratio": [[50], [50]]}]}
+    Les facteurs sont donnés pour chaque producteur, priorités et ratios pour chaque consommateur
+    et chaque producteur. Sans facteurs ou sans réglages, les valeurs actuelles sont utilisées."""
+    try:
+        data = request.get_json() or {}
+        strategy_list = [STRATEGY_MAPPING[key_type] for key_type in data.get('strategies', ['default'])]
+        setting_list = [(setting['priority'], setting['ratio']) for setting in data.get('settings', [])]
 
-        auto_consumption_rate = rep.get_auto_consumption_rate(0)
-        print("Taux d'autoconsommation : ", auto_consumption_rate, "%")
+        prod_list = get_prod_list()
+        cons_list = get_cons_list()
+        if not prod_list:
+            return jsonify({'success': False, 'message': 'Aucun producteur ajouté'})
+        if not cons_list:
+            return jsonify({'success': False, 'message': 'Aucun consommateur ajouté'})
 
-        index_cons = 0
-        auto_production_rate_global = 0
-        for cons in cons_list:
-            auto_production_rate = rep.get_auto_production_rate(index_cons)
-            auto_production_rate_global += auto_production_rate
-            index_cons += 1
-        auto_production_rate_global = rep.get_global_auto_production_rate(cons_list)
-        print("Taux d'autoproduction global : ", auto_production_rate_global, "%")
+        scenario_list = Scenario.build_grid(strategy_list, data.get('factors'), setting_list)
+        job = job_queue.submit(evaluate_scenarios_job, prod_list, cons_list, scenario_list)
+        return jsonify({
+            'success': True,
+            'message': f'Évaluation de {len(scenario_list)} scénarios lancée',
+            'job_id': job.id
+        })
 
-        coverage_rate = rep.get_coverage_rate(0, cons_list)
-        print("Taux de couverture : ", coverage_rate, "%")
+    except KeyError as e:
+        return jsonify({'success': False, 'message': f'Paramètre invalide : {str(e)}'})
+    except Exception as e:
+        print(f"Erreur lors de l'évaluation des scénarios : {str(e)}")
+        return jsonify({'success': False, 'message': f"Erreur lors de l'évaluation des scénarios : {str(e)}"})
+
+
+def optimize_job(job, prod_list, cons_list, min_ratio, min_share, max_evaluations):
+    """Recherche dans un job les priorités et ratios qui maximisent l'autoconsommation"""
+    job.step = 'Recherche des priorités et ratios'
+    optimization = Optimizer.optimize(prod_list, cons_list, min_ratio=min_ratio, min_share=min_share,
+                                      max_evaluations=max_evaluations, workers=app.config['COMPUTE_WORKERS'],
+                                      progress=job.set_progress)
+    job.step = 'Terminé'
+    return {'optimization': optimization}
+
+
+@app.route('/optimize', methods=['POST'])
+def optimize():
+    """Lance la recherche des priorités et ratios des consommateurs (stratégie dynamique)
+    qui maximisent l'autoconsommation, par exemple :
+        {"min_ratio": 5, "min_share": [10, 0, 5], "max_evaluations": 500}
+    min_ratio et min_share (part minimale de l'autoconsommation en %) sont donnés pour tous
+    les consommateurs ou pour chaque consommateur. Les réglages actuels ne sont pas modifiés."""
+    try:
+        data = request.get_json() or {}
+        prod_list = get_prod_list()
+        cons_list = get_cons_list()
+        if not prod_list:
+            return jsonify({'success': False, 'message': 'Aucun producteur ajouté'})
+        if not cons_list:
+            return jsonify({'success': False, 'message': 'Aucun consommateur ajouté'})
 
+        job = job_queue.submit(optimize_job, prod_list, cons_list,
+                               data.get('min_ratio', 0), data.get('min_share', 0),
+                               int(data.get('max_evaluations', Optimizer.MAX_EVALUATIONS)))
         return jsonify({
             'success': True,
-            'message': f'Calcul des clés de répartition terminé avec succès (Stratégie: {key_type})',
-            'indicators': {
-                'auto_consumption_rate': round(auto_consumption_rate, 2),
-                'auto_production_rate_global': round(auto_production_rate_global, 2),
-                'coverage_rate': round(coverage_rate, 2)
-            }
+            'message': 'Recherche des priorités et ratios lancée',
+            'job_id': job.id
         })
 
     except Exception as e:
-        print(f"Erreur lors du calcul : {str(e)}")
-        return jsonify({'success': False, 'message': f'Erreur lors du calcul : {str(e)}'})
+        print(f"Erreur lors de l'optimisation : {str(e)}")
+        return jsonify({'success': False, 'message': f"Erreur lors de l'optimisation : {str(e)}"})
+
+
+@app.route('/job_status/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Calcul introuvable'}), 404
+
+    result = job.to_dict()
+    result['success'] = job.status != Jobs.FAILED
+    if job.status == Jobs.DONE and 'scenario_list' in job.result:
+        result['message'] = 'Évaluation des scénarios terminée'
+        result['scenario_list'] = job.result['scenario_list']
+    elif job.status == Jobs.DONE and 'optimization' in job.result:
+        result['message'] = 'Recherche des priorités et ratios terminée'
+        result['optimization'] = job.result['optimization']
+    elif job.status == Jobs.DONE:
+        indicators = job.result['indicators']
+        result['message'] = f'Calcul des clés de répartition terminé avec succès (Stratégie: {job.result["key_type"]})'
+        result['indicators'] = {name: round(value, 2) for name, value in indicators.items()}
+    elif job.status == Jobs.FAILED:
+        result['message'] = f'Erreur lors du calcul : {job.error}'
+    return jsonify(result)
+
+
+def load_pyramid(file):
+    """Retourne les séries agrégées d'un calcul, ou None si le fichier n'existe plus
+    (entrée supprimée du cache de résultats)"""
+    try:
+        return load_pyramid_version(file, os.path.getmtime(file))
+    except OSError:
+        return None
 
 
-@app.route('/data')
-def chart_data():
-    global stat_file_generated
+@functools.lru_cache(maxsize=16)
+def load_pyramid_version(file, mtime):
+    """Retourne les séries agrégées d'un fichier, gardées en mémoire tant que le fichier n'est pas réécrit"""
+    return Aggregation.Pyramid.load(file)
 
-    res = "jour"
 
-    # Créer votre graphique
-    if stat_file_generated:
-        fig = go.Figure()
-
-        fig = Graph.generate_graph(stat_file_list[0],
-                                   ';',
-                                   group=False,
-                                   resolution=res)
-
-        fig.update_layout(
-            autosize=True,
-            # Forcer la configuration responsive
-            margin=dict(autoexpand=True)
-        )
+def parse_chart_date(value):
+    """Retourne la date envoyée par le graphique (ex : '2025-03-01 12:30:00.5'), ou None"""
+    if not value:
+        return None
+    try:
+        return np.datetime64(value.replace(' ', 'T'), 'm')
+    except ValueError:
+        return None
 
-        # Version ultra-simple
-        traces = []
-        for trace in fig.data:
-            traces.append({
-                'type': 'scatter',
-                'mode': 'lines',
-                'fill': 'tonexty' if len(traces) > 0 else 'tozeroy',
-                'stackgroup': 'one',
-                'name': trace.name,
-                'x': [str(x) for x in trace.x],
-                'y': [float(str(y)) for y in trace.y]  # Double conversion pour être sûr
-            })
 
-        result = {
-            'data': traces,
+def send_chart_data(result, etag):
+    """Retourne les données d'un graphique, compressées si le navigateur l'accepte,
+    ou une réponse 304 si le navigateur a déjà ces données"""
+    response = jsonify(result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.make_conditional(request)
+    if response.status_code == 200 and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/data')
+def chart_data():
+    # Afficher le résultat du calcul demandé, ou à défaut celui du dernier calcul terminé
+    job_id = request.args.get('job_id')
+    job = job_queue.get(job_id) if job_id else job_queue.get_last_done(lambda job: 'pyramid_file' in job.result)
+
+    # Format des données : 'json' (listes de valeurs) ou 'compact' (tableaux float32 en base64)
+    chart_format = request.args.get('format', Chart.JSON)
+    if chart_format not in Chart.FORMAT_LIST:
+        chart_format = Chart.JSON
+
+    # Résolution du graphique : 'creneau', 'heure', 'jour' ou 'mois'
+    res = request.args.get('resolution', Aggregation.DAY)
+    if res not in Aggregation.PYRAMID_RESOLUTION_LIST:
+        res = Aggregation.DAY
+
+    # Plage de dates affichée après un zoom, et largeur du graphique en pixels
+    start = parse_chart_date(request.args.get('start'))
+    stop = parse_chart_date(request.args.get('stop'))
+    width = request.args.get('width', type=int)
+    method = request.args.get('method', Chart.LTTB)
+    if method not in Chart.DOWNSAMPLING_LIST:
+        method = Chart.LTTB
+
+    # Les séries sont déjà agrégées : seuls les points affichés sont lus
+    # Si elles ne sont plus dans le cache, un graphique vide demande de relancer le calcul
+    pyramid = None
+    if job is not None and job.status == Jobs.DONE and 'pyramid_file' in job.result:
+        pyramid = load_pyramid(job.result['pyramid_file'])
+
+    # Créer votre graphique
+    if pyramid is not None:
+        with Metrics.timer('chart', resolution=res):
+            period_list, values = pyramid.get(res, start, stop)
+            # Réduire les courbes à environ un point par pixel, seule la plage affichée est détaillée
+            if width is not None and width > 0:
+                period_list, values = Chart.downsample(period_list, values, width, method)
+
+            result = Chart.build_data(period_list, values, pyramid.name_list, format=chart_format)
+        result.update({
             'layout': {
                 'title': 'Autoconsommation cumulée par ' + res,
                 'xaxis': {'title': 'Date'},
@@ -736,14 +1051,13 @@ def chart_data():
                     'yanchor': 'top'  # Ancrage par le haut de la légende
                 }
             },
-            'indicators': {
-                'auto_consumption_rate': auto_consumption_rate,
-                'auto_production_rate_global': auto_production_rate_global,
-                'coverage_rate': coverage_rate
-            }
-        }
+            'indicators': job.result['indicators']
+        })
 
-        return jsonify(result)
+        # Les données ne changent qu'avec le calcul : le navigateur les garde tant que l'ETag est le même
+        etag = hashlib.sha1(json.dumps([job.result['pyramid_file'], sorted(request.args.items()),
+                                        job.result['indicators']]).encode('utf-8')).hexdigest()
+        return send_chart_data(result, etag)
 
     else:
         # Retourner un graphique vide par défaut
@@ -783,5 +1097,22 @@ def chart_data():
         return jsonify(result)
 
 
+@app.route('/metrics')
+def metrics():
+    # Métriques du processus au format texte de Prometheus
+    return Response(Metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/job_profile/<job_id>')
+def job_profile(job_id):
+    # Rapport cProfile d'un calcul lancé avec profile=1
+    job = job_queue.get(job_id)
+    if job is None or job.profile is None:
+        return jsonify({'success': False, 'message': 'Profil introuvable'}), 404
+    return Response(job.profile, mimetype='text/plain')
+
+
 if __name__ == '__main__':
+    # Logs structurés des métriques (un JSON par ligne)
+    logging.basicConfig(level=logging.INFO)
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,10 @@
+# This module runs the differential check of Regression.py: every engine must give exactly the keys
+# and auto_consumption of the reference implementation, on sample curves and random communities
+import Regression
+
+
+def test_engines_match_reference():
+    result_list = Regression.run(nb_seed=3)
+    assert {result['engine'] for result in result_list} == set(Regression.ENGINE_LIST)
+    mismatch_list = [result for result in result_list if result['mismatched_slots'] > 0]
+    assert not mismatch_list, mismatch_list